@@ -1,5 +1,5 @@
 from ftsa.protocols.utils.TimeMeasure import Clock
-from ftsa.protocols.utils.CommMeasure import Bandwidth, User
+from ftsa.protocols.utils.CommMeasure import Bandwidth
 from ftsa.protocols.ccsftsa17.client import Client
 from ftsa.protocols.ccsftsa17.server import Server
 
@@ -55,7 +55,7 @@ def benchmark_ccs17(clients, server, scenario, repititions):
         online_round0_client_clock.measure_from_here()
         user, pks, pkc = clients[i+1].advertise_keys()
         online_round0_client_clock.measure_till_here()
-        online_round0_bandwith.measure_sent_data((user, pks, pkc), User.size)
+        online_round0_bandwith.measure_sent_data(Client.WC.encode_keys(user, pks, pkc))
         allpks[user] = pks
         allpkc[user] = pkc
 
@@ -75,13 +75,14 @@ def benchmark_ccs17(clients, server, scenario, repititions):
     ### **Round1** phase
     # The clients
     allekshares = {}
+    allkeysframe = Server.WC.encode_allkeys(allpks, allpkc)
     for i in range(scenario.nclients):
-        online_round1_bandwith.measure_rcvd_data((allpks, allpkc), User.size)
+        online_round1_bandwith.measure_rcvd_data(allkeysframe)
         online_round1_client_clock.measure_from_here()
         user, eshares = clients[i+1].share_keys(allpks, allpkc)
         online_round1_client_clock.measure_till_here()
-        online_round1_bandwith.measure_sent_data((user, eshares), User.size)
-        allekshares[user] = eshares
+        allekshares[user] = Client.WC.encode_shares(user, eshares)
+        online_round1_bandwith.measure_sent_data(allekshares[user])
 
     # The server 
     for i in range(repititions-1):
@@ -99,16 +100,20 @@ def benchmark_ccs17(clients, server, scenario, repititions):
     # The clients
     allY = {}
     for i in range(scenario.nclients):
-        online_round2_bandwith.measure_rcvd_data(allekshares[i+1], User.size)
+        frame = allekshares.pull(i+1)
+        online_round2_bandwith.measure_rcvd_data(frame)
         online_round2_client_clock.measure_from_here()
-        user, Y = clients[i+1].masked_input_collection(allekshares[i+1])
+        user, Y = clients[i+1].masked_input_collection(Client.WC.decode_shares(frame)[1])
         online_round2_client_clock.measure_till_here()
-        online_round2_bandwith.measure_sent_data((user, Y), [User.size, Client.expandedvaluesize])
+        online_round2_bandwith.measure_sent_data(Client.WC.encode_masked(user, Y))
         allY[user] = Y
 
-    # drop some clients
+    # drop some clients: the last ones never answer and the round is closed at its deadline
     nclientsnew = scenario.nclients - ceil(scenario.dropout * scenario.nclients)
-    allY = {idx:y for idx, y in allY.items() if idx <= nclientsnew }
+    phase = server.open_phase(deadline=0)
+    for user in range(1, nclientsnew + 1):
+        phase.submit(user, allY[user])
+    allY = phase.close()
     
     # The server
     for i in range(repititions-1):
@@ -127,12 +132,13 @@ def benchmark_ccs17(clients, server, scenario, repititions):
     # The clients
     allbshares = {}
     allkshares = {}
+    usersframe = Server.WC.encode_users(U3)
     for i in range(nclientsnew):
-        online_round4_bandwith.measure_rcvd_data(U3, User.size)
+        online_round4_bandwith.measure_rcvd_data(usersframe)
         online_round4_client_clock.measure_from_here()
         user, kshares, bshares = clients[i+1].unmasking(U3)
         online_round4_client_clock.measure_till_here()
-        online_round4_bandwith.measure_sent_data((user, kshares, bshares), User.size)
+        online_round4_bandwith.measure_sent_data(Client.WC.encode_unmask(user, kshares, bshares))
         allbshares[user] = bshares 
         allkshares[user] = kshares
 
@@ -1,6 +1,6 @@
 from ftsa.protocols.buildingblocks.JoyeLibert import TJLS
 from ftsa.protocols.utils.TimeMeasure import Clock
-from ftsa.protocols.utils.CommMeasure import Bandwidth, User
+from ftsa.protocols.utils.CommMeasure import Bandwidth
 from ftsa.protocols.ourftsa22.client import Client
 from ftsa.protocols.ourftsa22.server import Server
 
@@ -11,6 +11,7 @@ from copy import deepcopy
 import sys
 
 TJL_keysize = 2048
+STREAM_SLOTS = None # number of encoded elements per chunk of a streamed protected input (None: sent in one frame)
 
 def init_ours_scenario(scenario):
     
@@ -58,7 +59,7 @@ def benchmark_ours(clients, server, scenario, repititions):
         setup_register_client_clock.measure_from_here()
         user, pks, pkc = clients[i+1].setup_register()
         setup_register_client_clock.measure_till_here()
-        setup_register_bandwith.measure_sent_data((user, pks, pkc), User.size)
+        setup_register_bandwith.measure_sent_data(Client.WC.encode_keys(user, pks, pkc))
         allpks[user] = pks
         allpkc[user] = pkc
 
@@ -78,13 +79,14 @@ def benchmark_ours(clients, server, scenario, repititions):
     ### **Setup-KeySetup** phase
     # The clients
     allekshares = {}
+    allkeysframe = Server.WC.encode_allkeys(allpks, allpkc)
     for i in range(scenario.nclients):
-        setup_keysetup1_bandwith.measure_rcvd_data((allpks, allpkc), User.size)
+        setup_keysetup1_bandwith.measure_rcvd_data(allkeysframe)
         setup_keysetup1_client_clock.measure_from_here()
         user, eshares = clients[i+1].setup_keysetup(allpks, allpkc)
         setup_keysetup1_client_clock.measure_till_here()
-        setup_keysetup1_bandwith.measure_sent_data((user, eshares), User.size)
-        allekshares[user] = eshares
+        allekshares[user] = Client.WC.encode_shares(user, eshares)
+        setup_keysetup1_bandwith.measure_sent_data(allekshares[user])
 
     # The server 
     for i in range(repititions-1):
@@ -99,9 +101,10 @@ def benchmark_ours(clients, server, scenario, repititions):
 
     # The clients
     for i in range(scenario.nclients):
-        setup_keysetup2_bandwith.measure_rcvd_data(allekshares[i+1], User.size)
+        frame = allekshares.pull(i+1)
+        setup_keysetup2_bandwith.measure_rcvd_data(frame)
         setup_keysetup2_client_clock.measure_from_here()
-        clients[i+1].setup_keysetup2(allekshares[i+1])
+        clients[i+1].setup_keysetup2(Client.WC.decode_shares(frame)[1])
         setup_keysetup2_client_clock.measure_till_here()
         setup_keysetup2_bandwith.measure_sent_data()
 
@@ -114,26 +117,38 @@ def benchmark_ours(clients, server, scenario, repititions):
         clients[i+1].new_fl_step()
         online_encrypt_bandwith.measure_rcvd_data()
         online_encrypt_client_clock.measure_from_here()
-        user, eshares, Y = clients[i+1].online_encrypt()
-        online_encrypt_client_clock.measure_till_here()
-        online_encrypt_bandwith.measure_sent_data((user, eshares, Y), User.size)
-        allebshares[user] = eshares
+        if STREAM_SLOTS:
+            user, eshares, chunks = clients[i+1].online_encrypt_stream(STREAM_SLOTS)
+            Y = list(chunks)
+            online_encrypt_client_clock.measure_till_here()
+            # the encrypted shares and the chunks are sent in separate frames
+            with online_encrypt_bandwith.sent_counter() as counter:
+                allebshares[user] = counter.add(Client.WC.encode_shares(user, eshares))
+                for offset, chunk in Y:
+                    counter.add(Client.WC.encode_chunk(user, offset, chunk))
+        else:
+            user, eshares, Y = clients[i+1].online_encrypt()
+            online_encrypt_client_clock.measure_till_here()
+            allebshares[user] = Client.WC.encode_protected(user, eshares, Y)
+            online_encrypt_bandwith.measure_sent_data(allebshares[user])
         allY[user] = Y
 
-    # drop some clients
+    # drop some clients: the last ones never answer and the phase is closed at its deadline
     nclientsnew = scenario.nclients - ceil(scenario.dropout * scenario.nclients)
-    allY = {idx:y for idx, y in allY.items() if idx <= nclientsnew }
-    allebshares = {idx:y for idx, y in allebshares.items() if idx <= nclientsnew }
+    phase = server.open_phase(deadline=0)
+    for user in range(1, nclientsnew + 1):
+        phase.submit(user, allebshares[user], allY[user])
+    allebshares, allY = phase.close()
 
     # The server
     for i in range(repititions-1):
         server_copy = deepcopy(server)
         online_encrypt_server_clock.measure_from_here()
-        _ = server_copy.online_encrypt(allebshares, allY)
+        _ = server_copy.online_encrypt(allebshares, _streamed(allY))
         online_encrypt_server_clock.measure_till_here()
 
     online_encrypt_server_clock.measure_from_here()
-    allebshares = server.online_encrypt(allebshares, allY)
+    allebshares = server.online_encrypt(allebshares, _streamed(allY))
     online_encrypt_server_clock.measure_till_here()
 
 
@@ -143,11 +158,12 @@ def benchmark_ours(clients, server, scenario, repititions):
     allbshares = {}
     Yzeroshares = {}
     for i in range(nclientsnew):
-        online_construct_bandwith.measure_rcvd_data(allebshares[i+1], User.size)
+        frame = allebshares.pull(i+1)
+        online_construct_bandwith.measure_rcvd_data(frame)
         online_construct_client_clock.measure_from_here()
-        user, bshares, Yzeroshare = clients[i+1].online_construct(allebshares[i+1])
+        user, bshares, Yzeroshare = clients[i+1].online_construct(Client.WC.decode_shares(frame)[1])
         online_construct_client_clock.measure_till_here()
-        online_construct_bandwith.measure_sent_data((user, bshares, Yzeroshare), User.size)
+        online_construct_bandwith.measure_sent_data(Client.WC.encode_construct(user, bshares, Yzeroshare))
         allbshares[user] = bshares 
         Yzeroshares[user] = Yzeroshare
 
@@ -170,6 +186,9 @@ def benchmark_ours(clients, server, scenario, repititions):
         summ = list(map(add, summ, clients[i+1].X))
 
 
+    for client in clients.values():
+        client.close()
+
     setup_register_client_clock.finish()
     setup_register_server_clock.finish()
     setup_keysetup1_client_clock.finish()
@@ -189,6 +208,12 @@ def benchmark_ours(clients, server, scenario, repititions):
     return sumX == summ
 
 
+def _streamed(allY):
+    # the server consumes the streamed inputs as generators of chunks, a new one for each run
+    if not STREAM_SLOTS:
+        return allY
+    return {user : (chunk for chunk in chunks) for user, chunks in allY.items()}
+
 
 if __name__ == "__main__":
     runs = []
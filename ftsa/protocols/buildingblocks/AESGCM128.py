@@ -1,7 +1,7 @@
 """
 ### **Authenticated Encryption Scheme**
 
-This module contains a wraper for AES-GCM encryption from the library \"[Python Cryptography Toolkit (pycrypto)](https://cryptography.io/en/latest/)\"
+This module contains a wraper for AES-GCM encryption from the library \"[Python Cryptography Toolkit (pycrypto)](https://cryptography.io/en/latest/)\" and the channel sessions used to exchange messages between two users
 """
 
 from ftsa.protocols.utils.CommMeasure import getrealsize
@@ -40,13 +40,16 @@ class EncryptedMessage(object):
         self.ct = ciphertext
         self.tag = tag
         self.nonce = nonce
+        self._size = None
 
     def __repr__(self):
         return str(self.ct)
 
     def getrealsize(self):
-        """returns the size of the ciphertext in bits"""
-        return getrealsize(self.ct) + getrealsize(self.tag) + getrealsize(self.nonce)
+        """returns the size of the ciphertext in bits (computed once)"""
+        if self._size is None:
+            self._size = getrealsize(self.ct) + getrealsize(self.tag) + getrealsize(self.nonce)
+        return self._size
 
 
 class EncryptionKey(object):
@@ -89,4 +92,113 @@ class EncryptionKey(object):
     def decrypt(self, e : EncryptedMessage):
         """Decrypts and verfies the integrits of `EncryptedMessage` and returns the message bytes"""
         cipher = AES.new(self.key, AES.MODE_GCM, nonce = e.nonce)
-        return cipher.decrypt_and_verify(e.ct,e.tag)
\ No newline at end of file
+        return cipher.decrypt_and_verify(e.ct,e.tag)
+
+class ChannelSession(object):
+    """
+    An authenticated channel between two users sharing an AES-GCM key
+
+    The key is converted once. Each message is encrypted with a counter-based nonce (the sender identifier followed by the number of messages it sent), so the two directions of the channel never reuse a nonce. The identifiers of the sender and the receiver are authenticated as associated data instead of being encrypted with the message.
+
+    ## **Args**:
+    -------------
+    *key* : `bytes` or `int` or `gmpy2.mpz` --
+        the raw key value
+
+    *sender* : `int` --
+        the identifier of the user owning the session
+
+    *receiver* : `int` --
+        the identifier of the other user
+
+    ## **Attributes**:
+    -------------
+    *key* : `bytes` --
+        the AES-GCM key
+
+    *sender* : `int` --
+        the identifier of the user owning the session
+
+    *receiver* : `int` --
+        the identifier of the other user
+
+    *sent* : `int` --
+        the number of messages sent on the channel
+
+    *rcvd* : `int` --
+        the counter of the last message received on the channel
+    """
+    def __init__(self, key, sender, receiver) -> None:
+        super().__init__()
+        self.key = EncryptionKey(key).key
+        self.sender = sender
+        self.receiver = receiver
+        self.sent = 0
+        self.rcvd = 0
+        self._outheader = sender.to_bytes(2, "big") + receiver.to_bytes(2, "big")
+        self._inheader = receiver.to_bytes(2, "big") + sender.to_bytes(2, "big")
+        self._outprefix = sender.to_bytes(4, "big")
+        self._inprefix = receiver.to_bytes(4, "big")
+
+    def encrypt(self, m):
+        """Encrypts the message m for the other user and returns an `EncryptedMessage`"""
+        self.sent += 1
+        nonce = self._outprefix + self.sent.to_bytes(8, "big")
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(self._outheader)
+        ct, tag = cipher.encrypt_and_digest(m)
+        return EncryptedMessage(ct, tag, nonce)
+
+    def decrypt(self, e : EncryptedMessage):
+        """Decrypts and verfies the integrity of an `EncryptedMessage` sent by the other user and returns the message bytes"""
+        assert e.nonce[:4] == self._inprefix, "message not sent by user {}".format(self.receiver)
+        counter = int.from_bytes(e.nonce[4:], "big")
+        assert counter > self.rcvd, "replayed message"
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=e.nonce)
+        cipher.update(self._inheader)
+        m = cipher.decrypt_and_verify(e.ct, e.tag)
+        self.rcvd = counter
+        return m
+
+
+class ChannelSessions(object):
+    """
+    The channel sessions of a user with each other user
+
+    ## **Args**:
+    -------------
+    *user* : `int` --
+        the identifier of the user owning the sessions
+
+    ## **Attributes**:
+    -------------
+    *user* : `int` --
+        the identifier of the user owning the sessions
+
+    *sessions* : `dict` --
+        a `ChannelSession` for each other user {v : session}
+    """
+    def __init__(self, user) -> None:
+        super().__init__()
+        self.user = user
+        self.sessions = {}
+
+    def add(self, vuser, key):
+        """Opens the session with the user vuser using the agreed key"""
+        self.sessions[vuser] = ChannelSession(key, self.user, vuser)
+
+    def __contains__(self, vuser):
+        return vuser in self.sessions
+
+    def __getitem__(self, vuser):
+        return self.sessions[vuser]
+
+    def encrypt_many(self, messages):
+        """Encrypts the messages of a phase given as a dictionary {v : bytes}. It returns a dictionary {v : `EncryptedMessage`}"""
+        sessions = self.sessions
+        return {vuser : sessions[vuser].encrypt(m) for vuser, m in messages.items()}
+
+    def decrypt_many(self, emessages):
+        """Decrypts and verifies the messages of a phase given as a dictionary {v : `EncryptedMessage`}. It returns a dictionary {v : bytes}"""
+        sessions = self.sessions
+        return {vuser : sessions[vuser].decrypt(e) for vuser, e in emessages.items()}
@@ -0,0 +1,62 @@
+"""
+### ** Fixed-Point Encoding Scheme **
+
+This module quantizes real-valued vectors (e.g. float32 model updates) to vectors of non-negative integers that can be packed by the vector encoding scheme, and recovers the real-valued sum from the aggregated integers.
+"""
+
+import numpy as np
+
+from ftsa.protocols.buildingblocks.VectorEncoding import VES
+
+
+class FPES(object):
+    """
+    The fixed-point encoding class
+
+    Each element \\(x\\) is clipped to \\([-c, c]\\), offset by \\(c\\) and quantized to an integer of *valuesize* bits:
+    $$q = \\lfloor (x + c) \\cdot s \\rceil \\qquad s = \\frac{2^{valuesize} - 1}{2c}$$
+    The sum \\(Q\\) of the quantized vectors of \\(k\\) users is dequantized as \\(Q / s - k \\cdot c\\).
+
+    ** Args**:
+    -------------
+    *valuesize* : `int` --
+        The bit length of a quantized element (at most 53, the quantization is computed with `numpy.float64`)
+
+    *clip* : `float` --
+        The clipping bound \\(c\\) (default: 1.0)
+
+    ** Attributes**:
+    -------------
+    *valuesize* : `int` --
+        The bit length of a quantized element
+
+    *clip* : `float` --
+        The clipping bound \\(c\\)
+
+    *scale* : `float` --
+        The quantization scale \\(s\\)
+    """
+    def __init__(self, valuesize, clip=1.0) -> None:
+        super().__init__()
+        # the quantized elements must be exact in the 53-bit significand of a float64
+        assert valuesize <= 53, "quantized elements must fit in 53 bits"
+        assert clip > 0, "the clipping bound must be positive"
+        self.valuesize = valuesize
+        self.clip = clip
+        self.scale = (2**valuesize - 1) / (2 * clip)
+
+    def quantize(self, X):
+        """Quantizes a real-valued vector. It returns a `numpy.uint64` array of elements of *valuesize* bits"""
+        X = np.clip(np.asarray(X, dtype=np.float64), -self.clip, self.clip)
+        Q = np.rint((X + self.clip) * self.scale)
+        return np.minimum(Q, 2**self.valuesize - 1).astype(np.uint64)
+
+    def dequantize(self, Q, ncontrib=1):
+        """Recovers the real-valued sum of *ncontrib* quantized vectors from their (integer) sum. It returns a `numpy.float64` array"""
+        Q = np.asarray(Q, dtype=np.uint64).astype(np.float64)
+        return Q / self.scale - ncontrib * self.clip
+
+    @staticmethod
+    def ciphertexts(vectorsize, addops, ptsize, bitwidths=range(1, 33)):
+        """Reports, for each quantization bit width, the number of ciphertexts (packed plaintext slots) a vector of *vectorsize* elements is encoded to with `VES`. It returns a dictionary `{bits : nb. of ciphertexts}`"""
+        return {bits : VES(ptsize, addops, bits, vectorsize).numbatches for bits in bitwidths}
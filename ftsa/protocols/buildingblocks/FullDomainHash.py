@@ -1,9 +1,12 @@
 """
 ### **Full-Domain Hash**
 
-This module computes a full domain hash value usign SHA256 hash function
+This module computes a full domain hash value usign SHA256 hash function (or an extendable-output function such as SHAKE256)
 """
 
+import threading
+from collections import OrderedDict
+
 from Crypto.Hash import SHA256
 from gmpy2 import mpz, gcd
 
@@ -15,41 +18,119 @@ class FDH(object):
 
     ## **Args**:
     -------------
-    *bitsize* : `int` -- 
+    *bitsize* : `int` --
         The bitlength of the output of the FDH
-    
-    *N* : `int` -- 
-        The modulus \\(N\\) such that the FDH output is in \\(\\mathbb{Z}^*_N\\) 
+
+    *N* : `int` --
+        The modulus \\(N\\) such that the FDH output is in \\(\\mathbb{Z}^*_N\\)
+
+    *xof* : `module` --
+        An extendable-output function backend with the interface of `Crypto.Hash.SHAKE256` (default: `None`, the SHA256 construction is used)
+
+    *cachesize* : `int` --
+        The maximum number of hash values kept in the LRU cache (default: 16384)
 
     """
-    def __init__(self, bitsize, N) -> None:
+    def __init__(self, bitsize, N, xof=None, cachesize=16384) -> None:
         super().__init__()
         self.bitsize = bitsize
         self.N = N
+        self.xof = xof
+        self.cachesize = cachesize
+        self._cache = OrderedDict() # LRU cache {t : H(t)}
+        self._prefix = {} # hash states over the leading zero bytes of the input encoding {nb. of zero bytes : state}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        state["_prefix"] = {}
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     def H(self, t):
         """
         Computes the FDH using SHA256
-        
+
         It computes:
             $$\\textbf{SHA256}(x||0) ||\\textbf{SHA256}(x||1) || ... || \\textbf{SHA256}(x||c) \\mod N$$
         where \\(c\\) is a counter that keeps incrementing until the size of the output has *bitsize* length and the output falls in  \\(\\mathbb{Z}^*_N\\)
 
+        If an *xof* backend is given, it instead reads *bitsize* bits from \\(\\textbf{XOF}(x||c)\\) and reduces them modulo \\(N\\), incrementing \\(c\\) until the output falls in \\(\\mathbb{Z}^*_N\\)
+
         ## **Args**:
         -------------
-        *t* : `int` -- 
+        *t* : `int` --
             The input of the hash function
 
         ## **Returns**:
         ----------------
         A value in \\(\\mathbb{Z}^*_N\\) of type `gmpy2.mpz`
         """
+        return self.H_many([t])[0]
+
+    def H_many(self, taus):
+        """
+        Computes the FDH of a batch of inputs (e.g. all the element indices of a time period) in one pass.
+
+        The inputs share the same leading zero bytes, hence the hash state over these bytes is computed once for the whole batch. Recently computed values are served from an LRU cache.
+
+        ## **Args**:
+        -------------
+        *taus* : `list` --
+            The inputs of the hash function
+
+        ## **Returns**:
+        ----------------
+        A list of values in \\(\\mathbb{Z}^*_N\\) of type `gmpy2.mpz`
+        """
+        result = [None] * len(taus)
+        missing = []
+        with self._lock:
+            for i, t in enumerate(taus):
+                r = self._cache.get(t)
+                if r is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(t)
+                    result[i] = r
+        if not missing:
+            return result
+
+        # the inputs are encoded on bitsize/2 bytes, only the last bytes differ
+        size = self.bitsize // 2
+        width = max((int(taus[i]).bit_length() + 7) // 8 for i in missing)
+        prefix = self._prefix_state(size - width)
+        for i in missing:
+            suffix = int(taus[i]).to_bytes(width, "big")
+            result[i] = self._xof(prefix, suffix) if self.xof else self._sha256(prefix, suffix)
+
+        with self._lock:
+            for i in missing:
+                self._cache[taus[i]] = result[i]
+            while len(self._cache) > self.cachesize:
+                self._cache.popitem(last=False)
+        return result
+
+    def _prefix_state(self, zeros):
+        h = self._prefix.get(zeros)
+        if h is None:
+            h = self.xof.new() if self.xof else SHA256.new()
+            h.update(bytes(zeros))
+            self._prefix[zeros] = h
+        return h
+
+    def _sha256(self, prefix, suffix):
         counter = 1
         result = b''
         while True:
             while True:
-                h = SHA256.new()
-                h.update(int(t).to_bytes(self.bitsize // 2,"big") + counter.to_bytes(1,"big"))
+                h = prefix.copy()
+                h.update(suffix + counter.to_bytes(1,"big"))
                 result += h.digest()
                 counter += 1
                 if len(result) < (self.bitsize // 8):
@@ -60,3 +141,13 @@ class FDH(object):
             else:
                 print("HAPPENED")
         return r
+
+    def _xof(self, prefix, suffix):
+        counter = 1
+        while True:
+            h = prefix.copy()
+            h.update(suffix + counter.to_bytes(1,"big"))
+            r = mpz(int.from_bytes(h.read(self.bitsize // 8),"big")) % self.N
+            if gcd(r, self.N) == 1:
+                return r
+            counter += 1
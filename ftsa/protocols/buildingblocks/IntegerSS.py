@@ -7,9 +7,14 @@ This module contains an implementation of Shamir's secret sharing (t-out-of-n) o
 
 from os import urandom as rng
 from math import factorial, log2
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from gmpy2 import mpz
 
 from ftsa.protocols.buildingblocks.ShamirSS import Share
-from ftsa.protocols.buildingblocks.utils import powmod
+from ftsa.protocols.buildingblocks.utils import powmod, LAGRANGE_CACHE
 from ftsa.protocols.buildingblocks.FullDomainHash import FDH
 from ftsa.protocols.utils.CommMeasure import User
 
@@ -48,47 +53,58 @@ class ISSS(object):
     *sigma* : `int` --
         the security parameter for the ISS scheme
 
+    *workers* : `int` --
+        the number of processes used to evaluate the sharing polynomial (default: 1, no process is spawned)
+
     ## **Attributes**:
     -------------
     *bitlength* : `int` --
         the bit length of secrets to be shared
 
-    *Field* : `Field` --
-        The field to be used for the operations
+    *sigma* : `int` --
+        the security parameter for the ISS scheme
+
+    *workers* : `int` --
+        the number of processes used to evaluate the sharing polynomial
     
     """
-    def __init__(self, bitlength, sigma):
+    def __init__(self, bitlength, sigma, workers=1):
         super().__init__()
         self.bitlength = bitlength
         self.sigma = sigma
+        self.workers = workers
 
 
     def Share(self,secret,t,U):
-        """Shares a secret with n users with a threshold k. Returns a list of `IShare` elements"""
+        """Shares a secret with n users with a threshold k. Returns a list of `IShare` elements
+
+        The random coefficients are drawn with a single call to the randomness source and the polynomial is evaluated at all the indices of U together with `gmpy2.mpz` arithmetic. If *workers* > 1, the indices are split among a pool of processes, which is spawned on the first call and reused by all the schemes (the script creating it must guard its entry point with `if __name__ == "__main__"`)."""
 
         delta = factorial(len(U))
         coeffs = []
         bits = (self.bitlength + log2(delta**2) + self.sigma)
         IShare.bits = bits
         nbbytes = int( bits / 8)
-        for _ in range(t-1):
+        # one byte for the sign followed by nbbytes bytes for the absolute value of each coefficient
+        rand = rng((t-1) * (nbbytes + 1))
+        for i in range(0, (t-1) * (nbbytes + 1), nbbytes + 1):
             sign = 1
-            if int.from_bytes(rng(1),"big") % 2 == 0:
+            if rand[i] % 2 == 0:
                 sign = -1
-                coeff = sign * int.from_bytes(rng(nbbytes),"big")
-                coeffs.append(coeff)
+            coeffs.append(sign * mpz(int.from_bytes(rand[i+1:i+1+nbbytes],"big")))
 
-        coeffs.append(secret * delta)
+        coeffs.append(mpz(secret) * delta)
 
         # Each share is y_i = p(x_i) where x_i is the public index
         # associated to each user in U.
-
-        def make_share(idx, coeffs):
-            share = 0
-            for coeff in coeffs:
-                share = idx * share + coeff
-            return share
-        return [IShare(i, make_share(i, coeffs)) for i in U]
+        U = list(U)
+        if self.workers > 1 and len(U) > self.workers:
+            size = -(-len(U) // self.workers)
+            pool = _get_pool(self.workers)
+            values = [y for chunk in pool.map(_evaluate, [coeffs] * self.workers, [U[i:i+size] for i in range(0, len(U), size)]) for y in chunk]
+        else:
+            values = _evaluate(coeffs, U)
+        return [IShare(i, y) for i, y in zip(U, values)]
     
     def Recon(self, shares, t, delta):
         """Reconstructs a secret from a list of shares. If lagcoefs are not provided, it computes them. delta is factorial of the number of clients. Returns the secret as an integer"""
@@ -114,28 +130,10 @@ class ISSS(object):
 
 
     def _lagrange(self,shares,delta):
-        k = len(shares)
-        indices = []
-        for x in shares:
-            idx = x.idx
-            if any(y == idx for y in indices):
-                raise ValueError("Duplicate share")
-            indices.append(idx)
-
-        coefs = {}
-        for j in range(k):
-            x_j = indices[j]
-
-            numerator = 1
-            denominator = 1
-
-            for m in range(k):
-                x_m = indices[m]
-                if m != j:
-                    numerator *= x_m
-                    denominator *=  x_m - x_j
-            coefs[x_j] = (delta * numerator) // denominator
-        return coefs
+        indices = [x.idx for x in shares]
+        if len(set(indices)) != len(indices):
+            raise ValueError("Duplicate share")
+        return LAGRANGE_CACHE.integer(delta, indices)
                     
     def _recon(self, shares, t, delta, lagcoefs=None):
         assert len(shares) >= t, "not enough shares, cannot reconstruct!" 
@@ -149,23 +147,34 @@ class ISSS(object):
         k = len(shares)
         result = 0
         if not lagcoefs:
-            for j in range(k):
-                x_j, y_j = raw_shares[j]
-
-                numerator = 1
-                denominator = 1
-
-                for m in range(k):
-                    x_m = raw_shares[m][0]
-                    if m != j:
-                        numerator *= x_m
-                        denominator *= x_m - x_j
-                r = (y_j * delta * numerator) // denominator
-                result += r
-            return result // (delta**2)
-        else:
-            for j in range(k):
-                x_j, y_j = raw_shares[j]
-                r = y_j * lagcoefs[x_j]
-                result += r
-            return result // delta**2
+            lagcoefs = self._lagrange(shares, delta)
+        for j in range(k):
+            x_j, y_j = raw_shares[j]
+            r = y_j * lagcoefs[x_j]
+            result += r
+        return result // delta**2
+
+
+_pool = None # the processes evaluating the sharing polynomials, shared by all the schemes
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def _get_pool(workers):
+    # the pool is created on first use and kept; its processes are spawned (not forked) as the
+    # parent may be running threads (e.g. the pool of `batch_powmod`)
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def _evaluate(coeffs, indices):
+    # Horner's rule run on the vector of all the indices at once
+    xs = [mpz(x) for x in indices]
+    ys = [mpz(0)] * len(xs)
+    for coeff in coeffs:
+        ys = [y * x + coeff for y, x in zip(ys, xs)]
+    return ys
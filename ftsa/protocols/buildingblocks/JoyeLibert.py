@@ -17,8 +17,10 @@ and Data Security. Springer Berlin Heidelberg, 2013.*
 from math import factorial
 import random
 from gmpy2 import mpz
+import numpy as np
 
-from ftsa.protocols.buildingblocks.utils import getprimeover, invert, powmod
+from ftsa.protocols.buildingblocks.utils import getprimeover, invert, multipowmod, FixedExponent, LAGRANGE_CACHE, BATCH_CHUNK
+from ftsa.protocols.buildingblocks import utils
 from ftsa.protocols.buildingblocks.FullDomainHash import FDH
 from ftsa.protocols.buildingblocks.IntegerSS import ISSS, IShare
 
@@ -88,7 +90,7 @@ class JLS(object):
         fdh = FDH(self.keysize, n*n)
 
 
-        public_param = PublicParam(n, lmbda // 2, fdh.H)
+        public_param = PublicParam(n, lmbda // 2, fdh.H, fdh.H_many)
         
         seed = random.SystemRandom()
         s0 = mpz(0)
@@ -105,7 +107,7 @@ class JLS(object):
         return public_param, server, users
 
 
-    def Protect(self, pp, sk_u, tau, x_u_tau):
+    def Protect(self, pp, sk_u, tau, x_u_tau, offset=0):
         """
         Protect user input with the user's secret key: \\(y_{u,\\tau} \\gets \\textbf{JL.Protect}(pp,sk_u,\\tau,x_{u,\\tau})\\)
 
@@ -125,9 +127,12 @@ class JLS(object):
         *tau* : `int` --
             The time period \\(\\tau\\)
 
-        *x_u_tau* : `int` or `list` --
+        *x_u_tau* : `int`, `list` or `numpy.ndarray` --
             The user's input \\(x_{u,\\tau}\\)
 
+        *offset* : `int` --
+            The index of the first encoded element when *x_u_tau* is a chunk of a larger vector (default: 0)
+
         ## **Returns**:
         -------------
         The protected input of type `EncryptedNumber` or a list of `EncryptedNumber`
@@ -135,9 +140,9 @@ class JLS(object):
         assert isinstance(sk_u, UserKey), "bad user key"
         assert sk_u.pp == pp, "bad user key"
 
-        if isinstance(x_u_tau, list):
+        if isinstance(x_u_tau, (list, np.ndarray)):
             x_u_tau = self.VE.encode(x_u_tau)
-            return sk_u.encrypt(x_u_tau, tau)
+            return sk_u.encrypt(x_u_tau, tau, offset)
         else: 
             return sk_u.encrypt(x_u_tau, tau)
 
@@ -173,17 +178,9 @@ class JLS(object):
         assert sk_0.pp == pp, "bad server key"
         assert isinstance(list_y_u_tau, list), "list_y_u_tau should be a list"
         assert len(list_y_u_tau) > 0 , "list_y_u_tau should contain at least one protected input"
-        if isinstance(list_y_u_tau[0], list):
-            for y_u_tau in list_y_u_tau:
-                assert len(list_y_u_tau[0]) == len(y_u_tau), "attempting to aggregate protected vectors of different sizes"
-            y_tau=[]
-            for i in range(len(list_y_u_tau[0])):
-                y_tau_i = list_y_u_tau[0][i]
-                for y_u_tau in list_y_u_tau[1:]:
-                    y_tau_i += y_u_tau[i]
-                y_tau.append(y_tau_i)
-            d = sk_0.decrypt(y_tau, tau)
-            sum_x_u_tau = self.VE.decode(d)
+        if isinstance(list_y_u_tau[0], (list, CiphertextVector)):
+            y_tau = _aggregate_vectors(pp, list_y_u_tau)
+            sum_x_u_tau = sk_0.context(tau, 1, self.VE).decrypt(y_tau)
 
         else: 
             assert isinstance(list_y_u_tau[0], EncryptedNumber), "bad ciphertext"
@@ -212,6 +209,9 @@ class TJLS(JLS):
     *sigma* : `int`
         The security parameter \\(sigma\\) for **ISS** (default: 128)
 
+    *workers* : `int`
+        The number of processes used by **ISS** to evaluate the sharing polynomial of **SKShare** (default: 1, no process is spawned)
+
     ## **Attributes**:
     -------------        
     *threshold* : `int` --
@@ -220,6 +220,9 @@ class TJLS(JLS):
     *delta* : `int`
         The factorial of number of users
 
+    *delta2* : `FixedExponent`
+        The square of *delta*, used as exponent for all the elements of the aggregated vectors
+
     *sigma* : `int`
         The security parameter \\(sigma\\) for **ISS** (default: 128)
 
@@ -228,11 +231,13 @@ class TJLS(JLS):
 
 
     """
-    def __init__(self, nusers, threshold, VE=None, sigma=128):
+    def __init__(self, nusers, threshold, VE=None, sigma=128, workers=1):
         super().__init__(nusers, VE)
         self.threshold = threshold
         self.delta = factorial(self.nusers)
+        self.delta2 = FixedExponent(self.delta**2)
         self.sigma = sigma
+        self.workers = workers
         self.ISS = None
 
     def Setup(self, lmbda=DEFAULT_KEY_SIZE):
@@ -241,7 +246,7 @@ class TJLS(JLS):
         """
 
         public_param, server, users =  super().Setup(lmbda)
-        self.ISS = ISSS(self.keysize, self.sigma)
+        self.ISS = ISSS(self.keysize, self.sigma, self.workers)
         return public_param, server, users
 
     def SKShare(self, sk_u, t, U):
@@ -269,7 +274,7 @@ class TJLS(JLS):
         return self.ISS.Share(sk_u.s, t, U)
         
     
-    def ShareProtect(self, pp, list_sk_v_ushare, tau):
+    def ShareProtect(self, pp, list_sk_v_ushare, tau, progress=None):
         """
         Protect a zero value with u's shares of all failed users' secret keys: 
         $$[ y'_{\\tau}]_u \\gets \\textbf{TJL.ShareProtect}(pp,\\{[\\Delta sk_v]_u\\}_{v\\in \\mathcal{U}''},\\tau)$$
@@ -287,6 +292,9 @@ class TJLS(JLS):
         *tau* : `int` --
             The time period \\(\\tau\\)
 
+        *progress* : `callable` --
+            A function called as progress(done, total) with the number of protected elements while a vector is protected (default: `None`)
+
         
         ## **Returns**:
         ----------------
@@ -298,7 +306,8 @@ class TJLS(JLS):
             sharesum += share
         keyshare = UserKey(pp, sharesum.value) 
         if self.VE is not None:
-            yzero_ushare_tau =  self.Protect(pp, keyshare, tau, [0] * self.VE.vectorsize)
+            # the encoding of the zero vector is the zero vector, the protected value is made of the masks only
+            yzero_ushare_tau = RecoveryEngine(pp, self.VE.numbatches, progress=progress).protect(keyshare.exponent, tau)
             r = []
             for yzero_ushare_tau_i in yzero_ushare_tau: 
                 r.append(IShare(idx,yzero_ushare_tau_i))
@@ -343,29 +352,12 @@ class TJLS(JLS):
                 if any(y[0] == idx for y in raw_shares):
                     raise ValueError("Duplicate share")
                 raw_shares.append((idx, value))
-            k = len(shares)
-            result = 1
             if not lagcoefs:
-                for j in range(k):
-                    x_j, y_j = raw_shares[j]
-
-                    numerator = 1
-                    denominator = 1
-
-                    for m in range(k):
-                        x_m = raw_shares[m][0]
-                        if m != j:
-                            numerator *= x_m
-                            denominator *= x_m - x_j
-                    r = powmod(y_j.ciphertext,(delta * numerator) // denominator, pp.nsquare)
-                    result = (result * r) % pp.nsquare
-                return EncryptedNumber(pp,result)
-            else:
-                for j in range(k):
-                    x_j, y_j = raw_shares[j]
-                    r = powmod(y_j.ciphertext,lagcoefs[x_j],pp.nsquare)
-                    result = (result * r) % pp.nsquare
-                return EncryptedNumber(pp,result)
+                lagcoefs = LAGRANGE_CACHE.integer(delta, [x_j for x_j, _ in raw_shares])
+            # interpolate on the exponent with a single multi-exponentiation
+            bases = [y_j.ciphertext for _, y_j in raw_shares]
+            exps = [lagcoefs[x_j] for x_j, _ in raw_shares]
+            return multipowmod(bases, exps, pp.nsquare)
         
         if isinstance(list_yzero_ushare_tau[0], list):
             l = len(list_yzero_ushare_tau[0])
@@ -379,11 +371,13 @@ class TJLS(JLS):
                 for vshare in list_yzero_ushare_tau:
                     elementshares.append(vshare[counter])
                 if not lagcoef:
+                    # the same coefficients are used for all the elements, recode them once
                     lagcoef = self.ISS._lagrange(elementshares, self.delta)
+                    lagcoef = {x_j: FixedExponent(c) for x_j, c in lagcoef.items()}
                 vrecon.append(_recon(elementshares,t, self.delta, lagcoef))
-            return vrecon
+            return CiphertextVector(pp, vrecon)
         else:
-            return _recon(list_yzero_ushare_tau, t, self.delta)
+            return EncryptedNumber(pp, _recon(list_yzero_ushare_tau, t, self.delta))
         
 
 
@@ -424,34 +418,63 @@ class TJLS(JLS):
         assert sk_0.pp == pp, "bad server key"
         assert isinstance(list_y_u_tau, list), "list_y_u_tau should be a list"
         assert len(list_y_u_tau) > 0 , "list_y_u_tau should contain at least one protected input"
-        if not yzero_tau: assert(len(list_y_u_tau) == self.nusers), "missing user inputs and no protected zero-value"
-        if isinstance(list_y_u_tau[0], list):
-            if yzero_tau: assert len(list_y_u_tau[0]) == len(yzero_tau), "bad vector length"
-            for y_u_tau in list_y_u_tau:
-                assert len(y_u_tau) == len(list_y_u_tau[0]), "bad vector length"
-            y_tau=[]
-            delta = 1
-            for i in range(len(list_y_u_tau[0])):
-                y_tau_i = list_y_u_tau[0][i]
-                for y_u_tau in list_y_u_tau[1:]:
-                    y_tau_i += y_u_tau[i]
-                if len(list_y_u_tau) != self.nusers:
-                    y_tau_i = EncryptedNumber(pp,powmod(y_tau_i.ciphertext, self.delta**2, sk_0.pp.nsquare))
-                    y_tau_i +=  yzero_tau[i]
-                    delta = self.delta
-                y_tau.append(y_tau_i)
-
-            d = sk_0.decrypt(y_tau, tau, delta)
-            sum_x_u_tau = self.VE.decode(d)
-
+        if isinstance(list_y_u_tau[0], (list, CiphertextVector)):
+            y_tau = _aggregate_vectors(pp, list_y_u_tau)
         else: 
             assert isinstance(list_y_u_tau[0], EncryptedNumber), "bad ciphertext"
             y_tau = list_y_u_tau[0]
-            delta = 1
             for y_u_tau in list_y_u_tau[1:]:
                 y_tau += y_u_tau
-            if len(list_y_u_tau) != self.nusers:
-                y_tau = EncryptedNumber(pp,powmod(y_tau.ciphertext, self.delta**2, sk_0.pp.nsquare))
+
+        return self.Finalize(pp, sk_0, tau, y_tau, len(list_y_u_tau), yzero_tau)
+
+    def Finalize(self, pp, sk_0, tau, y_tau, nusers, yzero_tau=None):
+        """
+        Finalize the aggregation of the product of the online users' protected inputs with the server's secret key: 
+        $$X_{\\tau} \\gets \\textbf{TJL.Finalize}(pp, sk_0,\\tau, \\prod\\limits_{\\forall u \\in \\mathcal{U}'}{y_{u,\\tau}},y'_\\tau)$$
+
+        ### This is the second half of **TJL.Agg**. It allows the server to multiply the protected inputs as they arrive (keeping a single running product) and to only raise the product to the power \\({\\Delta^2}\\), multiply it with the protected zero-value, and decrypt it at the end of the time period.
+
+        ## **Args**:
+        -------------
+        *pp* : `PublicParam` --
+            The public parameters \\(pp\\)
+
+        *sk_0* : `ServerKey` --
+            The server's secret key \\(sk_0\\)
+
+        *tau* : `int` --
+            The time period \\(\\tau\\)
+
+        *y_tau* : `EncryptedNumber` or `CiphertextVector` --
+            The product of the online users' protected inputs \\(\\prod\\limits_{\\forall u \\in \\mathcal{U}'}{y_{u,\\tau}}\\)
+
+        *nusers* : `int` --
+            The number of online users \\(|\\mathcal{U}'|\\)
+
+        *yzero_tau* : `EncryptedNumber` or `CiphertextVector` --
+            The protected zero-value of the failed users (default: `None`)
+
+        ## **Returns**:
+        -------------
+        The sum of the users' inputs of type `int` (or the decoded vector of type `list`)
+        """
+        assert isinstance(sk_0, ServerKey), "bad server key"
+        assert sk_0.pp == pp, "bad server key"
+        if not yzero_tau: assert(nusers == self.nusers), "missing user inputs and no protected zero-value"
+        delta = 1
+        if isinstance(y_tau, CiphertextVector):
+            if yzero_tau: assert len(y_tau) == len(yzero_tau), "bad vector length"
+            if nusers != self.nusers:
+                y_tau = y_tau ** self.delta2
+                y_tau += _as_vector(pp, yzero_tau)
+                delta = self.delta
+            sum_x_u_tau = sk_0.context(tau, delta, self.VE).decrypt(y_tau)
+
+        else: 
+            assert isinstance(y_tau, EncryptedNumber), "bad ciphertext"
+            if nusers != self.nusers:
+                y_tau = EncryptedNumber(pp,self.delta2.apply(y_tau.ciphertext, sk_0.pp.nsquare))
                 y_tau += yzero_tau
                 delta = self.delta
             sum_x_u_tau = sk_0.decrypt(y_tau, tau, delta)
@@ -473,6 +496,9 @@ class PublicParam(object):
     **H** : `function` --
         The hash algorithm \\(H : \\mathbb{Z} \\rightarrow \\mathbb{Z}_{N^2}^{*}\\)
 
+    **H_many** : `function` --
+        The batch version of the hash algorithm \\(H\\) (default: `None`)
+
 
     ## **Attributes**:
     -------------
@@ -487,17 +513,27 @@ class PublicParam(object):
 
     **H** : `function` --
         The hash algorithm \\(H : \\mathbb{Z} \\rightarrow \\mathbb{Z}_{N^2}^{*}\\)
+
+    **H_many** : `function` --
+        The batch version of the hash algorithm \\(H\\)
     """
-    def __init__(self, n, bits, H):
+    def __init__(self, n, bits, H, H_many=None):
         super().__init__()
         self.n = n
         self.nsquare = n * n
         self.bits = bits
         self.H = H
+        self.H_many = H_many
 
     def __eq__(self, other):
         return self.n == other.n
 
+    def hash_many(self, taus):
+        """Computes the hash of a list of inputs, in one batch when *H_many* is available"""
+        if self.H_many is not None:
+            return self.H_many(taus)
+        return [self.H(t) for t in taus]
+
     def __repr__(self):
         hashcode = hex(hash(self.H))
         nstr = self.n.digits()
@@ -522,13 +558,26 @@ class UserKey(object):
 
     **key** : `gmpy2.mpz` --
         The value of the user's key \\(sk_0\\)
+
+    **exponent** : `FixedExponent` --
+        The user's key as an exponent applied to the hash of all the elements
+
+    **masks** : `MaskPrecomputer` --
+        An optional service holding the precomputed masks of the upcoming time periods (default: `None`)
     """
 
     def __init__(self, param, key):
         super().__init__()
         self.pp = param
         self.s = key
+        self.exponent = FixedExponent(key)
+        self.masks = None
 
+    def __getstate__(self):
+        # the mask precomputation service is local to the process holding the key
+        state = self.__dict__.copy()
+        state["masks"] = None
+        return state
 
     def __repr__(self):
         hashcode = hex(hash(self))
@@ -540,7 +589,7 @@ class UserKey(object):
     def __hash__(self):
         return hash(self.s)
 
-    def encrypt(self, plaintext, tau):
+    def encrypt(self, plaintext, tau, offset=0):
         """
         Encrypts a plaintext  for time period tau  
     
@@ -552,23 +601,50 @@ class UserKey(object):
         **tau** : `int` --
             the time period 
 
+        **offset** : `int` --
+            the counter of the first element when the plaintext is a chunk of a larger list (default: 0). The element counters are carried into the time period of each element
+
         ## **Returns**:
         ---------------
-        A ciphertext of the *plaintext* encrypted by the user key of type `EncryptedNumber`
+        A ciphertext of the *plaintext* encrypted by the user key of type `EncryptedNumber` (or `CiphertextVector` if the plaintext is a list)
         """
         if isinstance(plaintext, list):
-            counter = 0
-            cipher = []
-            for pt in plaintext:
-                cipher.append(self._encrypt(pt, (counter << self.pp.bits // 2) | tau))
-                counter += 1
+            taus = [(counter << self.pp.bits // 2) | tau for counter in range(offset, offset + len(plaintext))]
+            masks = None
+            # the precomputed masks cover whole vectors only
+            if self.masks is not None and offset == 0 and len(taus) == self.masks.nelements:
+                masks = self.masks.pop(tau)
+            if not masks or len(masks) < len(taus):
+                masks = self.mask(taus)
+            ciphertexts = []
+            for pt, r in zip(plaintext, masks):
+                ciphertexts.append((self.pp.n * pt + 1) * r % self.pp.nsquare)
+            cipher = CiphertextVector(self.pp, ciphertexts)
         else: 
             cipher = self._encrypt(plaintext, tau)
         return cipher
 
-    def _encrypt(self, plaintext, tau):
+    def mask(self, tau):
+        """
+        Computes the mask \\(H(\\tau)^{sk_u} \\mod N^2\\) of time period tau. It does not depend on the plaintext, hence it can be precomputed (see `MaskPrecomputer`)
+
+        ## **Args**:
+        -------------
+        **tau** : `int` or `list` --
+            the time period (or a list of time periods)
+
+        ## **Returns**:
+        ---------------
+        The mask of type `gmpy2.mpz` (or a list of masks)
+        """
+        if isinstance(tau, list):
+            return self.exponent.apply_many(self.pp.hash_many(tau), self.pp.nsquare)
+        return self.exponent.apply(self.pp.H(tau), self.pp.nsquare)
+
+    def _encrypt(self, plaintext, tau, r=None):
         nude_ciphertext = (self.pp.n * plaintext + 1) % self.pp.nsquare
-        r = powmod(self.pp.H(tau), self.s, self.pp.nsquare)
+        if r is None:
+            r = self.mask(tau)
         ciphertext = (nude_ciphertext * r) % self.pp.nsquare
         return EncryptedNumber(self.pp, ciphertext)
 
@@ -614,47 +690,200 @@ class ServerKey(object):
     
         ## **Args**:
         -------------
-        **cipher** : `EncryptedNumber` --
-            An aggregated ciphertext 
+        **cipher** : `EncryptedNumber` or `list` --
+            An aggregated ciphertext (or a vector of aggregated ciphertexts)
 
         **tau** : `int` --
             the time period 
 
+        **delta** : `int` --
+            the factor \\(\\Delta\\) the aggregated ciphertext is raised to (default: 1)
+
         ## **Returns**:
         ---------------
-        The sum of user inputs of type `int`
+        The sum of user inputs of type `int` (or a list of `int`)
         """
-    
-        if isinstance(cipher, list):
-            counter = 0
-            pt = []
-            for c in cipher:
-                pt.append(self._decrypt(c, (counter << self.pp.bits // 2) | tau, delta))
-                counter +=1
-        else: 
-            pt = self._decrypt(cipher, tau, delta)
-        return pt
-    
-    def _decrypt(self, cipher, tau, delta=1):
+        return self.context(tau, delta).decrypt(cipher)
+
+    def context(self, tau, delta=1, VE=None):
+        """
+        Builds the decryption context of time period tau (see `DecryptionContext`)
+
+        ## **Args**:
+        -------------
+        **tau** : `int` --
+            the time period 
+
+        **delta** : `int` --
+            the factor \\(\\Delta\\) the aggregated ciphertexts are raised to (default: 1)
+
+        **VE** : `VectorEncoding` --
+            the vector encoding scheme used to decode the decrypted vectors (default: `None`)
+
+        ## **Returns**:
+        ---------------
+        A `DecryptionContext`
+        """
+        return DecryptionContext(self, tau, delta, VE)
+
+
+class DecryptionContext(object):
+    """
+    The decryption context of the server for a time period \\(\\tau\\) and a factor \\(\\Delta\\).
+
+    ### It computes once the invariants of the decryption \\(X_{\\tau} = \\frac{V_{\\tau}-1}{N{\\Delta^2}} \\mod N\\) where \\(V_{\\tau} = H(\\tau)^{\\Delta^2 sk_0} \\cdot y_{\\tau}\\): the exponent \\(\\Delta^2 sk_0\\) and the inverse of \\(\\Delta^2\\). When the server key is zero (as in our protocol), the hash \\(H(\\tau)\\) is not computed at all.
+
+    ## **Args**:
+    -------------
+    **key** : `ServerKey` --
+        The server key
+
+    **tau** : `int` --
+        The time period 
+
+    **delta** : `int` --
+        The factor \\(\\Delta\\) the aggregated ciphertexts are raised to (default: 1)
+
+    **VE** : `VectorEncoding` --
+        The vector encoding scheme used to decode the decrypted vectors (default: `None`)
+
+    ## **Attributes**:
+    -------------
+    **pp** : `PublicParam` --
+        The public parameters
+
+    **tau** : `int` --
+        The time period 
+
+    **exponent** : `FixedExponent` --
+        The exponent \\(\\Delta^2 sk_0\\) of the hash
+
+    **inverse** : `gmpy2.mpz` --
+        The inverse of \\(\\Delta^2\\)
+
+    **VE** : `VectorEncoding` --
+        The vector encoding scheme
+    """
+    def __init__(self, key, tau, delta=1, VE=None):
+        super().__init__()
+        self.pp = key.pp
+        self.tau = tau
+        self.exponent = FixedExponent(delta**2 * key.s)
+        self.inverse = invert(delta**2, self.pp.nsquare)
+        self.VE = VE
+
+    def decrypt(self, cipher):
+        """
+        Decrypts an aggregated ciphertext, or a vector of aggregated ciphertexts in one batch. The element \\(i\\) of a vector is decrypted with \\(\\tau_i = (i \\ll bits/2) | \\tau\\).
+
+        ## **Args**:
+        -------------
+        **cipher** : `EncryptedNumber`, `CiphertextVector` or `list` --
+            An aggregated ciphertext (or a vector of aggregated ciphertexts)
+
+        ## **Returns**:
+        ---------------
+        The sum of user inputs of type `int` or a list of `int` (decoded with *VE* if given)
+        """
+        if isinstance(cipher, (list, CiphertextVector)):
+            cipher = _as_vector(self.pp, cipher)
+            if self.pp != cipher.pp:
+                raise ValueError('encrypted_number was encrypted against a '
+                                 'different key!')
+            ciphertexts = cipher.ciphertexts
+            taus = [(counter << self.pp.bits // 2) | self.tau for counter in range(len(cipher))]
+            pt = self._raw_decrypt(ciphertexts, taus)
+            if self.VE is not None:
+                pt = self.VE.decode(pt)
+            return pt
+        self._check(cipher)
+        return self._raw_decrypt([cipher.ciphertext], [self.tau])[0]
+
+    def _check(self, cipher):
         if not isinstance(cipher, EncryptedNumber):
             raise TypeError('Expected encrypted number type but got: %s' %
                             type(cipher))
         if self.pp != cipher.pp:
             raise ValueError('encrypted_number was encrypted against a '
                              'different key!')
-        return self._raw_decrypt(cipher.ciphertext, tau, delta)
-    
 
-    def _raw_decrypt(self, ciphertext, tau, delta=1):
-        if not isinstance(ciphertext, mpz):
-            raise TypeError('Expected mpz type ciphertext but got: %s' %
-                        type(ciphertext))
-        V = (ciphertext * powmod(self.pp.H(tau), delta**2 * self.s, self.pp.nsquare)) % self.pp.nsquare
-        X = ((V - 1) // self.pp.n)  % self.pp.n
-        X = (X * invert(delta**2, self.pp.nsquare)) % self.pp.n
-        return int(X)
+    def _raw_decrypt(self, ciphertexts, taus):
+        for ciphertext in ciphertexts:
+            if not isinstance(ciphertext, mpz):
+                raise TypeError('Expected mpz type ciphertext but got: %s' %
+                            type(ciphertext))
+        if self.exponent.bits == 0:
+            V = ciphertexts
+        else:
+            masks = self.exponent.apply_many(self.pp.hash_many(taus), self.pp.nsquare)
+            V = [(c * r) % self.pp.nsquare for c, r in zip(ciphertexts, masks)]
+        pt = []
+        for v in V:
+            X = ((v - 1) // self.pp.n)  % self.pp.n
+            X = (X * self.inverse) % self.pp.n
+            pt.append(int(X))
+        return pt
     
 
+class RecoveryEngine(object):
+    """
+    The engine computing the masks \\(H(\\tau_i)^{e} \\mod N^2\\) of all the elements of a vector for one exponent \\(e\\), i.e. a user's share of the protected zero-value \\([y'_{\\tau}]_u\\) where \\(e = \\sum_{v\\in \\mathcal{U}''}[\\Delta sk_v]_u\\).
+
+    ### The exponent is much larger than a user key, hence this is the most expensive step of the dropout recovery. The elements are processed in chunks: the hashes of a chunk are computed in one batch and the exponentiations are spread over the cores by `batch_powmod` with the same `FixedExponent`. After each chunk, the progress is reported, so that a slow recovering user can be told from a failed one.
+
+    ## **Args**:
+    -------------
+    **param** : `PublicParam` --
+        The public parameters
+
+    **nelements** : `int` --
+        The number of elements of the vector
+
+    **chunksize** : `int` --
+        The number of elements per chunk (default: enough elements to keep all the `batch_powmod` threads busy)
+
+    **progress** : `callable` --
+        A function called as progress(done, total) after each chunk (default: `None`)
+
+    ## **Attributes**:
+    -------------
+    **pp** : `PublicParam` --
+        The public parameters
+
+    **nelements** : `int` --
+        The number of elements of the vector
+
+    **chunksize** : `int` --
+        The number of elements per chunk
+
+    **done** : `int` --
+        The number of elements already protected
+    """
+    def __init__(self, param, nelements, chunksize=None, progress=None):
+        super().__init__()
+        self.pp = param
+        self.nelements = nelements
+        self.chunksize = chunksize or max(4 * BATCH_CHUNK, utils.BATCH_WORKERS * BATCH_CHUNK)
+        self.progress = progress
+        self.done = 0
+
+    def protect(self, exponent, tau):
+        """Computes the masks of all the elements for time period tau with the exponent (an `int` or a `FixedExponent`). It returns a `CiphertextVector`"""
+        if not isinstance(exponent, FixedExponent):
+            exponent = FixedExponent(exponent)
+        shift = self.pp.bits // 2
+        ciphertexts = []
+        self.done = 0
+        for start in range(0, self.nelements, self.chunksize):
+            stop = min(start + self.chunksize, self.nelements)
+            taus = [(i << shift) | tau for i in range(start, stop)]
+            ciphertexts.extend(exponent.apply_many(self.pp.hash_many(taus), self.pp.nsquare))
+            self.done = stop
+            if self.progress is not None:
+                self.progress(self.done, self.nelements)
+        return CiphertextVector(self.pp, ciphertexts)
+
+
 class EncryptedNumber(object):
     """
     An encrypted number by one of the user keys .
@@ -710,3 +939,139 @@ class EncryptedNumber(object):
         returns the size of the ciphertext
         """
         return self.pp.bits*2
+
+
+class CiphertextVector(object):
+    """
+    A vector of ciphertexts encrypted against the same public parameters.
+
+    It holds the raw residues modulo \\(N^2\\) in one sequence of `gmpy2.mpz`. The public parameters are checked once per vector operation instead of once per element.
+
+    ## **Args**:
+    -------------
+    **param** : `PublicParam` --
+        The public parameters
+
+    **ciphertexts** : `list` --
+        The residues of the ciphertexts of type `gmpy2.mpz`
+
+    ## **Attributes**:
+    -------------
+    **param** : `PublicParam` --
+        The public parameters
+
+    **ciphertexts** : `list` --
+        The residues of the ciphertexts of type `gmpy2.mpz`
+    """
+    def __init__(self, param, ciphertexts):
+        super().__init__()
+        self.pp = param
+        self.ciphertexts = ciphertexts
+
+    @staticmethod
+    def fromlist(param, cipher):
+        """Builds a `CiphertextVector` from a list of `EncryptedNumber`"""
+        for c in cipher:
+            if not isinstance(c, EncryptedNumber):
+                raise TypeError('Expected encrypted number type but got: %s' %
+                                type(c))
+            if param != c.pp:
+                raise ValueError('encrypted_number was encrypted against a '
+                                 'different key!')
+        return CiphertextVector(param, [c.ciphertext for c in cipher])
+
+    @staticmethod
+    def width(param):
+        """Returns the number of bytes of an encoded residue"""
+        return (param.nsquare.bit_length() + 7) // 8
+
+    @staticmethod
+    def from_bytes(param, data):
+        """Decodes a `CiphertextVector` from the concatenation of fixed-width big-endian residues"""
+        w = CiphertextVector.width(param)
+        data = memoryview(data)
+        if len(data) % w != 0:
+            raise ValueError("the encoded vector is not a multiple of {} bytes".format(w))
+        return CiphertextVector(param, [mpz(int.from_bytes(data[i:i+w],"big")) for i in range(0, len(data), w)])
+
+    def to_bytes(self):
+        """Encodes the vector as the concatenation of fixed-width big-endian residues"""
+        w = CiphertextVector.width(self.pp)
+        return b''.join(int(c).to_bytes(w,"big") for c in self.ciphertexts)
+
+    @staticmethod
+    def identity(param, size):
+        """Returns a vector of *size* neutral elements of the aggregation (the residue 1, an encryption of zero with a unit mask)"""
+        return CiphertextVector(param, [mpz(1)] * size)
+
+    def copy(self):
+        """Returns a copy of the vector"""
+        return CiphertextVector(self.pp, list(self.ciphertexts))
+
+    def add_at(self, other, offset):
+        """Aggregates (in place) the vector *other* into the elements starting at index *offset*, and returns the vector"""
+        return self._add_encrypted(other, offset)
+
+    def __len__(self):
+        return len(self.ciphertexts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CiphertextVector(self.pp, self.ciphertexts[i])
+        return EncryptedNumber(self.pp, self.ciphertexts[i])
+
+    def __iter__(self):
+        for c in self.ciphertexts:
+            yield EncryptedNumber(self.pp, c)
+
+    def __repr__(self):
+        return "<CiphertextVector of {} elements>".format(len(self.ciphertexts))
+
+    def __add__(self, other):
+        return self.copy()._add_encrypted(other)
+
+    def __iadd__(self, other):
+        return self._add_encrypted(other)
+
+    def __pow__(self, exponent):
+        if not isinstance(exponent, FixedExponent):
+            exponent = FixedExponent(exponent)
+        return CiphertextVector(self.pp, exponent.apply_many(self.ciphertexts, self.pp.nsquare))
+
+    def _add_encrypted(self, other, offset=None):
+        other = _as_vector(self.pp, other)
+        if self.pp != other.pp:
+            raise ValueError("Attempted to add numbers encrypted against "
+                             "different prameters!")
+        if offset is None:
+            if len(self) != len(other):
+                raise ValueError("Attempted to add vectors of different sizes")
+            offset = 0
+        elif offset < 0 or offset + len(other) > len(self):
+            raise ValueError("Attempted to add a vector out of bounds")
+        nsquare = self.pp.nsquare
+        C = self.ciphertexts
+        for i, c in enumerate(other.ciphertexts, offset):
+            C[i] = C[i] * c % nsquare
+        return self
+
+    def getrealsize(self):
+        """
+        returns the size of the ciphertexts
+        """
+        return self.pp.bits*2*len(self.ciphertexts)
+
+
+def _as_vector(pp, cipher):
+    if isinstance(cipher, CiphertextVector):
+        return cipher
+    return CiphertextVector.fromlist(pp, cipher)
+
+def _aggregate_vectors(pp, list_y_u_tau):
+    vectors = [_as_vector(pp, y_u_tau) for y_u_tau in list_y_u_tau]
+    for y_u_tau in vectors:
+        assert len(vectors[0]) == len(y_u_tau), "attempting to aggregate protected vectors of different sizes"
+    y_tau = vectors[0].copy()
+    for y_u_tau in vectors[1:]:
+        y_tau += y_u_tau
+    return y_tau
@@ -1,54 +1,225 @@
 """
 ### **Key-Agreement Scheme**
 
-This module contains a wraper for Elliptec Curve DH scheme over NIST256p the  from the library \"[Python Cryptography Toolkit (pycrypto)](https://cryptography.io/en/latest/)\"
+This module contains a wraper for Elliptec Curve DH scheme over NIST256p. The elliptic curve arithmetic is delegated to a backend: the default one uses the library \"[PyCryptodome](https://www.pycryptodome.org)\" and derives the agreed keys with HKDF-SHA256, while the legacy one uses the library \"[ecdsa](https://github.com/tlsfuzzer/python-ecdsa)\" and its original key derivation.
 
 """
 
+from abc import ABC, abstractmethod
+
 from ecdsa import ECDH, NIST256p
+from ecdsa.keys import VerifyingKey
 from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC
 from gmpy2 import mpz
 
-class KAS(object):
-    """A key-agreement class that holds the secret and public keys of a party"""
+from ftsa.protocols.buildingblocks.utils import batch_map
+
+
+class KASBackend(ABC):
+    """The interface of an elliptic curve DH backend. A backend is stateless: the keys are passed to each method"""
+
+    @abstractmethod
+    def generate(self):
+        """Generates a key pair. It returns the tuple (secret key, public key)"""
+
+    @abstractmethod
+    def from_bytes(self, bytes):
+        """Loads a secret key from its bytes. It returns the tuple (secret key, public key)"""
+
+    @abstractmethod
+    def sk_bytes(self, sk):
+        """Returns the bytes of a secret key"""
+
+    @abstractmethod
+    def pk_bytes(self, pk):
+        """Returns an encoding of a public key (used to identify the peers)"""
+
+    @abstractmethod
+    def load_pk(self, pk, pem=False):
+        """Loads a public key of another party (a key object, its bytes or its PEM encoding)"""
+
+    @abstractmethod
+    def shared_secret(self, sk, pk):
+        """Computes the shared secret (bytes) between a secret key and a public key"""
+
+    @abstractmethod
+    def derive(self, secret, size):
+        """Derives a key of `size` bits from a shared secret. It returns an `mpz`"""
+
+
+class CryptodomeKey(object):
+    """A PyCryptodome ECC key (secret or public). PyCryptodome keys hold C objects: the wrapper pickles (and deep-copies) them through their encoding
+
+    ## **Args**:
+    -------------
+    *key* : `EccKey` --
+        The PyCryptodome key
+    """
+    def __init__(self, key) -> None:
+        super().__init__()
+        self.key = key
+
+    def __reduce__(self):
+        if self.key.has_private():
+            return _load_ecckey, (self.key.curve, int(self.key.d))
+        return _load_ecckey, (self.key.curve, None, self.key.export_key(format="raw"))
+
+    def __repr__(self):
+        if self.key.has_private():
+            return "<CryptodomeKey secret>"
+        return "<CryptodomeKey {}>".format(self.key.export_key(format="raw").hex())
+
+    def getrealsize(self):
+        """returns the size of the encoded public key in bits"""
+        return len(self.key.public_key().export_key(format="raw")) * 8
+
+
+class CryptodomeBackend(KASBackend):
+    """The elliptic curve DH backend over the library PyCryptodome. The agreed keys are derived from the shared secret with HKDF-SHA256. The keys are `CryptodomeKey`s"""
+    curve = "P-256"
+    """The curve used by the backend"""
+    info = b"ftsa-kas"
+    """The context information of the key derivation"""
+
+    def generate(self):
+        sk = ECC.generate(curve=CryptodomeBackend.curve)
+        return CryptodomeKey(sk), CryptodomeKey(sk.public_key())
+
+    def from_bytes(self, bytes):
+        sk = ECC.construct(curve=CryptodomeBackend.curve, d=int.from_bytes(bytes, "big"))
+        return CryptodomeKey(sk), CryptodomeKey(sk.public_key())
+
+    def sk_bytes(self, sk):
+        return int(sk.key.d).to_bytes(32, "big")
+
+    def pk_bytes(self, pk):
+        return pk.key.export_key(format="raw")
+
+    def load_pk(self, pk, pem=False):
+        if isinstance(pk, CryptodomeKey):
+            return pk
+        if pem:
+            return CryptodomeKey(ECC.import_key(pk))
+        return CryptodomeKey(ECC.import_key(pk, curve_name=CryptodomeBackend.curve))
+
+    def shared_secret(self, sk, pk):
+        assert not pk.key.has_private(), "the peer key must be a public key"
+        point = pk.key.pointQ * sk.key.d
+        return int(point.x).to_bytes(32, "big")
+
+    def derive(self, secret, size):
+        return mpz(int.from_bytes(HKDF(secret, size // 8, b"", SHA256, context=CryptodomeBackend.info), "big"))
+
+
+def _load_ecckey(curve, d=None, raw=None):
+    if d is not None:
+        return CryptodomeKey(ECC.construct(curve=curve, d=d))
+    return CryptodomeKey(ECC.import_key(raw, curve_name=curve))
+
+
+class EcdsaBackend(KASBackend):
+    """The elliptic curve DH backend over the library ecdsa. It keeps the original key derivation (the SHA256 hashes of the shared secret and a counter), so the agreed keys are the same as in the previous versions of the package"""
     curve = NIST256p
-    """The curve used by the scheme (default: NIST256P)"""
-    def __init__(self) -> None:
+    """The curve used by the backend"""
+
+    def generate(self):
+        ecdh = ECDH(EcdsaBackend.curve)
+        pk = ecdh.generate_private_key()
+        return ecdh.private_key, pk
+
+    def from_bytes(self, bytes):
+        ecdh = ECDH(EcdsaBackend.curve)
+        pk = ecdh.load_private_key_bytes(bytes)
+        return ecdh.private_key, pk
+
+    def sk_bytes(self, sk):
+        return sk.to_string()
+
+    def pk_bytes(self, pk):
+        return pk.to_string()
+
+    def load_pk(self, pk, pem=False):
+        if isinstance(pk, VerifyingKey):
+            return pk
+        if pem:
+            return VerifyingKey.from_pem(pk)
+        return VerifyingKey.from_string(pk, curve=EcdsaBackend.curve)
+
+    def shared_secret(self, sk, pk):
+        ecdh = ECDH(EcdsaBackend.curve, private_key=sk, public_key=pk)
+        return ecdh.generate_sharedsecret_bytes()
+
+    def derive(self, secret, size):
+        counter = 0
+        result = b''
+        while len(result) < (size // 8):
+            h = SHA256.new()
+            h.update(secret + counter.to_bytes(1,"big"))
+            result += h.digest()
+            counter += 1
+        return mpz(int.from_bytes(result[-size:],"big"))
+
+
+class KAS(object):
+    """A key-agreement class that holds the secret and public keys of a party
+
+    The shared secret with each peer is computed once (one scalar multiplication) and cached; the agreed keys of any size are derived from it.
+
+    ## **Args**:
+    -------------
+    *backend* : `KASBackend` --
+        The elliptic curve DH backend (default: `KAS.backend`)
+
+    ## **Attributes**:
+    -------------
+    *backend* : `KASBackend` --
+        The elliptic curve DH backend
+
+    *sk* : --
+        The secret key (in the format of the backend)
+
+    *pk* : --
+        The public key (in the format of the backend)
+    """
+    backend = CryptodomeBackend()
+    """The default backend of the scheme (default: `CryptodomeBackend`)"""
+    def __init__(self, backend=None) -> None:
         super().__init__()
-        self.ecdh = ECDH(KAS.curve)
+        self.backend = backend or KAS.backend
         self.sk = None
         self.pk = None
+        self._secrets = {}
 
     def generate(self):
         """Generates a key pair of public and private key"""
-        self.pk = self.ecdh.generate_private_key()
-        self.sk = self.ecdh.private_key
+        self.sk, self.pk = self.backend.generate()
+        self._secrets = {}
         return self
 
     def generate_from_bytes(self, bytes):
         """Generates the public key from the bytes of the private key"""
-        self.pk = self.ecdh.load_private_key_bytes(bytes)
-        self.sk = self.ecdh.private_key
+        self.sk, self.pk = self.backend.from_bytes(bytes)
+        self._secrets = {}
         return self
 
     def agree(self, pk, size=256, pem=False):
         """Agree on a shared key of size `size` using the public key `pk` of the other party"""
-        if not pem:
-            self.ecdh.load_received_public_key(pk)
-        else:
-            self.ecdh.load_received_public_key_pem(pk)
-        h = SHA256.new()
-        h.update(self.ecdh.generate_sharedsecret_bytes())
-        counter = 0
-        result = b''
-        while len(result) < (size // 8):
-            h = SHA256.new()
-            h.update(self.ecdh.generate_sharedsecret_bytes() + counter.to_bytes(1,"big"))
-            result += h.digest()
-            counter += 1
-        r = mpz(int.from_bytes(result[-size:],"big"))
-        return r
+        pk = self.backend.load_pk(pk, pem)
+        peer = self.backend.pk_bytes(pk)
+        secret = self._secrets.get(peer)
+        if secret is None:
+            secret = self.backend.shared_secret(self.sk, pk)
+            self._secrets[peer] = secret
+        return self.backend.derive(secret, size)
+
+    def agree_many(self, pks, size=256, pem=False):
+        """Agree on a shared key of size `size` with several parties. *pks* is a dictionary `{party : public key}`. The scalar multiplications are run with the pool of `utils.batch_map`. It returns a dictionary `{party : shared key}`"""
+        parties = list(pks)
+        keys = batch_map(lambda party: self.agree(pks[party], size, pem), parties)
+        return dict(zip(parties, keys))
 
     def get_sk_bytes(self):
         """Returns the bytes of the secret key"""
-        return self.sk.to_string()
+        return self.backend.sk_bytes(self.sk)
@@ -0,0 +1,124 @@
+"""
+### **Mask Precomputation for Joye-Libert**
+
+This module precomputes the Joye-Libert masks \\(H(\\tau_i)^{sk_u} \\mod N^2\\) of a user for the upcoming time periods. A mask only depends on the time period \\(\\tau\\) and on the element counter \\(i\\) (not on the user input), hence it can be computed in a background worker while the user is idle. Protecting an element with a precomputed mask costs a single modular multiplication.
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+
+class MaskPrecomputer(object):
+    """
+    A service that precomputes the masks of a user key for the next time periods and keeps them in a bounded store
+
+    All the precomputers of a process share one background worker, which serves their pending time periods in turn: the number of threads does not grow with the number of users.
+
+    ## **Args**:
+    -------------
+    *key* : `UserKey` --
+        The user key \\(sk_u\\)
+
+    *nelements* : `int` --
+        The number of masks per time period (the number of elements of a protected vector)
+
+    *lookahead* : `int` --
+        The number of upcoming time periods to precompute (default: 2)
+
+    *capacity* : `int` --
+        The maximum number of time periods kept in the store, the oldest ones are evicted first (default: *lookahead* + 1)
+
+    ## **Attributes**:
+    -------------
+    *key* : `UserKey` --
+        The user key \\(sk_u\\)
+
+    *nelements* : `int` --
+        The number of masks per time period
+
+    *lookahead* : `int` --
+        The number of upcoming time periods to precompute
+
+    *capacity* : `int` --
+        The maximum number of time periods kept in the store
+    """
+    _cond = threading.Condition() # guards the state of all the precomputers
+    _queue = deque() # precomputers with pending time periods, served in turn
+    _worker = None # the shared background worker
+
+    def __init__(self, key, nelements, lookahead=2, capacity=None) -> None:
+        super().__init__()
+        self.key = key
+        self.nelements = nelements
+        self.lookahead = lookahead
+        self.capacity = capacity or lookahead + 1
+        self._store = OrderedDict() # precomputed masks {tau : [mask_0, mask_1, ...]}
+        self._pending = [] # time periods waiting for the worker
+        self._running = None # time period being computed by the worker
+        self._stopped = False
+
+    def schedule(self, tau):
+        """Schedules the precomputation of the masks of the time periods \\(\\tau, \\tau+1, ..., \\tau+lookahead-1\\)"""
+        cls = MaskPrecomputer
+        with cls._cond:
+            if self._stopped:
+                return
+            for t in range(tau, tau + self.lookahead):
+                if t in self._store or t in self._pending or t == self._running:
+                    continue
+                self._pending.append(t)
+            if self._pending and self not in cls._queue:
+                cls._queue.append(self)
+            if cls._worker is None or not cls._worker.is_alive():
+                cls._worker = threading.Thread(target=cls._run, daemon=True)
+                cls._worker.start()
+            cls._cond.notify_all()
+
+    def pop(self, tau):
+        """Returns the masks of time period tau and removes them from the store.
+
+        If the worker is currently computing them, it waits for the result. If they are not available, it returns `None` and the caller computes the masks itself."""
+        with MaskPrecomputer._cond:
+            while self._running == tau:
+                MaskPrecomputer._cond.wait()
+            if tau in self._pending:
+                self._pending.remove(tau)
+            # masks of past time periods are never requested again
+            for t in [t for t in self._store if t < tau]:
+                del self._store[t]
+            return self._store.pop(tau, None)
+
+    def stop(self):
+        """Stops the precomputation and clears the store"""
+        cls = MaskPrecomputer
+        with cls._cond:
+            self._stopped = True
+            self._pending = []
+            self._store.clear()
+            if self in cls._queue:
+                cls._queue.remove(self)
+            cls._cond.notify_all()
+
+    @staticmethod
+    def _run():
+        cls = MaskPrecomputer
+        while True:
+            with cls._cond:
+                while not cls._queue:
+                    cls._cond.wait()
+                pc = cls._queue.popleft()
+                tau = pc._pending.pop(0)
+                pc._running = tau
+                if pc._pending:
+                    cls._queue.append(pc)
+
+            shift = pc.key.pp.bits // 2
+            masks = pc.key.mask([(i << shift) | tau for i in range(pc.nelements)])
+
+            with cls._cond:
+                pc._running = None
+                if not pc._stopped:
+                    pc._store[tau] = masks
+                    while len(pc._store) > pc.capacity:
+                        pc._store.popitem(last=False)
+                cls._cond.notify_all()
@@ -6,6 +6,9 @@ This module contains a wraper for AES-CTR encryption from the library \"[Python
 from Crypto.Cipher import AES
 from math import ceil
 from gmpy2 import mpz
+import numpy as np
+
+from ftsa.protocols.buildingblocks.utils import iadd_vectors, isubs_vectors, batch_map
 
 class PRG(object):
     """
@@ -19,6 +22,9 @@ class PRG(object):
     *elementsize* : `int` --
         the size of each element of the vector in bits
 
+    *asarray* : `bool` --
+        if `True`, the output vector is a `numpy.uint64` array (elementsize must be at most 64 bits) (default: `False`)
+
     ## **Attributes**:
     -------------
     *m* : `int` --
@@ -29,22 +35,79 @@ class PRG(object):
     
     *e* : `int` --
         the size of each element of the vector in bytes
+
+    *asarray* : `bool` --
+        whether the output vector is a `numpy.uint64` array
     """
     _zero=0
     _nonce = _zero.to_bytes(12,"big")
     security = 128
     """The bitlength of the input of the PRG"""
-    def __init__(self, vectorsize, elementsize) -> None:
+    CHUNK = 8192
+    """The number of elements expanded at once by `eval_sum` (a multiple of 16, so that every chunk starts on an AES block)"""
+    def __init__(self, vectorsize, elementsize, asarray=False) -> None:
         super().__init__()
         self.m = vectorsize
         self.bits = elementsize
         self.e = ceil(elementsize / 8)
+        self.asarray = asarray
+        if asarray:
+            assert elementsize <= 64, "array output requires elements of at most 64 bits"
 
-    def eval(self,x):
+    def eval(self,x, start=0, stop=None):
         """Computes AES-CTR of an empty string of size equal \\(m \\times bits\\) and then splits the result to generate a vector.
         
-        It returns a vector of \\(m\\) elements each of size \\(bits\\) bits
+        It returns a vector of \\(m\\) elements each of size \\(bits\\) bits (a `numpy.uint64` array read directly from the keystream if *asarray* is set). If *start* or *stop* is given, only the elements in the range [start, stop) are generated, starting from the matching AES-CTR block
         """
+        if stop is None:
+            stop = self.m
+        # the keystream starts on the AES block which contains the first byte of element start
+        skip = start * self.e % 16
+        c = AES.new(self._key(x), AES.MODE_CTR, nonce=PRG._nonce, initial_value=start * self.e // 16)
+        cipher = c.encrypt(b''.rjust(self.e*(stop - start) + skip, b'\x00'))[skip:]
+        if self.asarray:
+            return self._toarray(cipher)
+        return [int.from_bytes(cipher[i:i+self.e],"big") % 2**self.bits for i in range(0,len(cipher), self.e)]
+
+    def eval_sum(self, seeds, signs, modulus):
+        """Computes the signed sum of the expansions of several seeds \\(\\sum_j s_j \\cdot \\textbf{PRG}(x_j) \\mod r\\) where \\(s_j \\in \\{1,-1\\}\\).
+
+        The output is computed chunk by chunk: for each chunk of `CHUNK` elements, the keystreams of all the seeds are generated from the matching AES-CTR block and accumulated in a single buffer, hence the expanded vectors are never materialized. The chunks are spread over the `batch_map` thread pool (AES-CTR and the NumPy operations release the GIL). This requires *bits* and \\(\\log_2(r)\\) to be at most 64; otherwise, the seeds are expanded one by one.
+
+        It returns a vector of \\(m\\) elements (a `numpy.uint64` array if *asarray* is set)
+        """
+        assert len(seeds) == len(signs), "the number of seeds and signs differ"
+        modulus = int(modulus)
+        if self.bits > 64 or modulus & (modulus - 1) or modulus > 2**64:
+            V = [0] * self.m
+            for seed, sign in zip(seeds, signs):
+                if sign > 0:
+                    V = iadd_vectors(V, self.eval(seed), modulus)
+                else:
+                    V = isubs_vectors(V, self.eval(seed), modulus)
+            return V
+
+        keys = [self._key(seed) for seed in seeds]
+        mask = np.uint64(modulus - 1)
+        out = np.empty(self.m, dtype=np.uint64)
+
+        def expand(start):
+            stop = min(start + PRG.CHUNK, self.m)
+            zeros = bytes((stop - start) * self.e)
+            acc = np.zeros(stop - start, dtype=np.uint64)
+            for key, sign in zip(keys, signs):
+                c = AES.new(key, AES.MODE_CTR, nonce=PRG._nonce, initial_value=start * self.e // 16)
+                if sign > 0:
+                    np.add(acc, self._toarray(c.encrypt(zeros)), out=acc)
+                else:
+                    np.subtract(acc, self._toarray(c.encrypt(zeros)), out=acc)
+            np.bitwise_and(acc, mask, out=acc)
+            out[start:stop] = acc
+
+        batch_map(expand, range(0, self.m, PRG.CHUNK))
+        return out if self.asarray else out.tolist()
+
+    def _key(self, x):
         seed = x
         if isinstance(seed, mpz):
             seed = int(x)
@@ -55,7 +118,16 @@ class PRG(object):
             seed = seed.to_bytes(PRG.security // 8, "big")
         elif not isinstance(seed, bytes):
             raise ValueError("seed should be of type either int or bytes")
+        return seed[:PRG.security // 8]
 
-        c = AES.new(seed[:PRG.security // 8], AES.MODE_CTR, nonce=PRG._nonce, initial_value=0)
-        cipher = c.encrypt(b''.rjust(self.e*self.m, b'\x00'))
-        return [int.from_bytes(cipher[i:i+self.e],"big") % 2**self.bits for i in range(0,len(cipher), self.e)]
+    def _toarray(self, cipher):
+        if self.e in (1, 2, 4, 8):
+            V = np.frombuffer(cipher, dtype=">u{}".format(self.e)).astype(np.uint64)
+        else:
+            # left pad each big-endian element to 8 bytes
+            padded = np.zeros((len(cipher) // self.e, 8), dtype=np.uint8)
+            padded[:, 8 - self.e:] = np.frombuffer(cipher, dtype=np.uint8).reshape(-1, self.e)
+            V = padded.view(">u8").reshape(-1).astype(np.uint64)
+        if self.bits < 64:
+            np.bitwise_and(V, np.uint64(2**self.bits - 1), out=V)
+        return V
@@ -0,0 +1,95 @@
+"""
+### **Parallel Encryption for Joye-Libert**
+
+This module shards the encryption of an encoded vector with a Joye-Libert user key across a pool of processes. The user key and the public parameters are read-only: they are sent once to each worker (by the pool initializer) and only the plaintext shards travel with the tasks. The encryption is asynchronous, so the caller can do other work (e.g. sharing its mask seed) while the workers compute the exponentiations. The workers are spawned processes, hence the script creating a pool must guard its entry point with `if __name__ == "__main__"`.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from ftsa.protocols.buildingblocks.JoyeLibert import CiphertextVector
+from ftsa.protocols.buildingblocks.utils import set_batch_workers
+
+_worker_key = None # the user key of the worker process
+
+
+class EncryptionPool(object):
+    """
+    A pool of processes encrypting shards of vectors with a fixed user key
+
+    ## **Args**:
+    -------------
+    *key* : `UserKey` --
+        The user key \\(sk_u\\)
+
+    *workers* : `int` --
+        The number of processes (default: the number of cores)
+
+    ## **Attributes**:
+    -------------
+    *key* : `UserKey` --
+        The user key \\(sk_u\\)
+
+    *workers* : `int` --
+        The number of processes
+    """
+    def __init__(self, key, workers=None) -> None:
+        super().__init__()
+        self.key = key
+        self.workers = workers or os.cpu_count() or 1
+        # the workers are spawned, not forked: the parent runs threads (the mask precomputation, the pool of `batch_powmod`) whose locks a fork would copy in any state
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"), initializer=_init_worker, initargs=(key,))
+
+    def submit(self, plaintext, tau, offset=0):
+        """Starts the encryption of a list of (encoded) plaintexts for time period tau, split in one shard per worker. It returns a `PendingVector` whose `result()` is the `CiphertextVector`"""
+        size = -(-len(plaintext) // self.workers) or 1
+        futures = []
+        for start in range(0, len(plaintext), size):
+            futures.append(self._pool.submit(_encrypt_shard, plaintext[start:start+size], tau, offset + start))
+        return PendingVector(self.key.pp, futures)
+
+    def encrypt(self, plaintext, tau, offset=0):
+        """Encrypts a list of (encoded) plaintexts for time period tau. It returns a `CiphertextVector`"""
+        return self.submit(plaintext, tau, offset).result()
+
+    def close(self):
+        """Shuts down the worker processes"""
+        self._pool.shutdown()
+
+
+class PendingVector(object):
+    """
+    A `CiphertextVector` being computed by an `EncryptionPool`
+
+    ## **Args**:
+    -------------
+    *param* : `PublicParam` --
+        The public parameters
+
+    *futures* : `list` --
+        The futures of the shards of the vector (in order)
+    """
+    def __init__(self, param, futures) -> None:
+        super().__init__()
+        self.pp = param
+        self.futures = futures
+
+    def result(self):
+        """Waits for all the shards and returns the `CiphertextVector`"""
+        ciphertexts = []
+        for f in self.futures:
+            ciphertexts.extend(f.result())
+        return CiphertextVector(self.pp, ciphertexts)
+
+
+def _init_worker(key):
+    global _worker_key
+    # the masks precomputed by the parent are not available in a worker
+    key.masks = None
+    _worker_key = key
+    # the worker processes already use all the cores
+    set_batch_workers(1)
+
+def _encrypt_shard(plaintext, tau, offset):
+    return _worker_key.encrypt(list(plaintext), tau, offset).ciphertexts
@@ -3,9 +3,7 @@
 
 This module contains an implementation of Shamir's secret sharing (t-out-of-n) over a field of user choice.
 """
-from os import urandom as rng
-
-from ftsa.protocols.buildingblocks.utils import P64Field, P128Field, P256Field, P512Field, P1024Field, P2048Field
+from ftsa.protocols.buildingblocks.utils import P64Field, P128Field, P256Field, P512Field, P1024Field, P2048Field, FieldVector, LAGRANGE_CACHE
 from ftsa.protocols.utils.CommMeasure import User
 
 
@@ -82,75 +80,68 @@ class SSS(object):
         self.bitlength = bitlength
 
     def lagrange(self,shares):
-        """computes the lagrange coefetions. It returns a dictionary of user indices as keys and lagrange coeficients as values"""
-        k = len(shares)
-
-        gf_ind = []
-        for x in shares:
-            idx = self.Field(x.idx)
-            if any(y == idx for y in gf_ind):
-                raise ValueError("Duplicate share")
-            gf_ind.append(idx)
-
-        coefs = {}
-        for j in range(k):
-            x_j = gf_ind[j]
-
-            numerator = self.Field(1)
-            denominator = self.Field(1)
-
-            for m in range(k):
-                x_m = gf_ind[m]
-                if m != j:
-                    numerator *= x_m
-                    denominator *=  x_m - x_j
-            coefs[x_j] = numerator * denominator.inverse()
-        return coefs
+        """computes the lagrange coefetions. It returns a dictionary of user indices as keys and lagrange coeficients as values (the coefficients are cached per set of indices)"""
+        indices = [x.idx for x in shares]
+        if len(set(indices)) != len(indices):
+            raise ValueError("Duplicate share")
+        return LAGRANGE_CACHE.field(self.Field, indices)
                     
     def share(self,k, n, secret):
         """Shares a secret with n users with a threshold k. Returns a list of `Share` elements"""
-        coeffs = [self.Field(rng(self.bitlength//8)) for i in range(k - 1)]
-        coeffs.append(self.Field(secret))
+        return self.share_many([secret], k, n)[0]
+
+    def share_many(self, secrets, k, n):
+        """Shares each secret of a list with n users with a threshold k. Returns, for each secret, a list of `Share` elements
+
+        The polynomials of all the secrets are evaluated together on `FieldVector` elements (one vector per coefficient degree) and their random coefficients are drawn in bulk."""
+        p = self.Field(0).p
+        m = len(secrets)
+        coeffs = [FieldVector.random(m, p, self.bitlength//8) for i in range(k - 1)]
+        coeffs.append(FieldVector([self.Field(secret)._value for secret in secrets], p))
 
         # Each share is y_i = p(x_i) where x_i is the public index
         # associated to each of the n users.
-
-        def make_share(user, coeffs):
-            idx = self.Field(user)
-            share = self.Field(0)
+        columns = []
+        for user in range(1, n + 1):
+            share = FieldVector([0] * m, p)
             for coeff in coeffs:
-                share = idx * share + coeff
-            return share
-        return [Share(i, make_share(i, coeffs)) for i in range(1, n + 1)]
+                share = share * user + coeff
+            columns.append(share)
+        return [[Share(i, self.Field(columns[i-1][s])) for i in range(1, n + 1)] for s in range(m)]
 
     def recon(self,shares, lagcoefs=None):
         """Reconstructs a secret from a list of shares. If lagcoefs are not provided, it computes them. Returns the secret as an integer"""
-
-        gf_shares = []
-        for x in shares:
-            idx = self.Field(x.idx)
-            value = x.value
-            if any(y[0] == idx for y in gf_shares):
-                raise ValueError("Duplicate share")
-            gf_shares.append((idx, value))
-        k = len(shares)
-        result = self.Field(0)
+        return self.recon_many([shares], lagcoefs)[0]
+
+    def recon_many(self, share_matrix, lagcoefs=None):
+        """Reconstructs several secrets whose shares are held by the same set of users. *share_matrix* contains, for each secret, its list of shares. If lagcoefs are not provided, it computes them. Returns the list of secrets as integers
+
+        The reconstruction is a single matrix-vector product between the shares (one `FieldVector` per holder) and the Lagrange coefficients."""
+        if not share_matrix:
+            return []
+        holders = [x.idx for x in share_matrix[0]]
+        if len(set(holders)) != len(holders):
+            raise ValueError("Duplicate share")
+        columns = {idx : [] for idx in holders}
+        holderset = set(holders)
+        for shares in share_matrix:
+            if len(shares) != len(holders) or set(x.idx for x in shares) != holderset:
+                raise ValueError("Shares held by different users")
+            for x in shares:
+                columns[x.idx].append(x.value._value)
         if not lagcoefs:
-            for j in range(k):
-                x_j, y_j = gf_shares[j]
-
-                numerator = self.Field(1)
-                denominator = self.Field(1)
-
-                for m in range(k):
-                    x_m = gf_shares[m][0]
-                    if m != j:
-                        numerator *= x_m
-                        denominator *= x_m - x_j
-                result += y_j * numerator * denominator.inverse()
-            return result._value
-        else: 
-            for j in range(k):
-                x_j, y_j = gf_shares[j]
-                result += y_j * lagcoefs[x_j]
-            return result._value
\ No newline at end of file
+            lagcoefs = self.lagrange(share_matrix[0])
+        p = self.Field(0).p
+        result = FieldVector.lincomb([lagcoefs[self.Field(idx)]._value for idx in holders], [FieldVector(columns[idx], p) for idx in holders], p)
+        return result.values
+
+    def recon_users(self, shares):
+        """Reconstructs the secrets of several users given as a dictionary `{user : list of shares}`. The users are grouped by the set of share holders and each group is reconstructed with one call to `recon_many`. Returns a dictionary `{user : secret}`"""
+        groups = {}
+        for user in shares:
+            groups.setdefault(frozenset(x.idx for x in shares[user]), []).append(user)
+        secrets = {}
+        for users in groups.values():
+            for user, secret in zip(users, self.recon_many([shares[user] for user in users])):
+                secrets[user] = secret
+        return secrets
\ No newline at end of file
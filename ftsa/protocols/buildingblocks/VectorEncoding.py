@@ -7,6 +7,9 @@ This module encodes and decodes vector elements to create smaller size vectors u
 
 from math import ceil, log2, floor
 import gmpy2 
+import numpy as np
+
+from ftsa.protocols.buildingblocks.utils import to_array
 
 class VES(object):
     """
@@ -26,6 +29,9 @@ class VES(object):
     *vectorsize* : `int` --
         The number of element of the input vector
 
+    *asarray* : `bool` --
+        If `True`, the decoded vector is a `numpy.uint64` array (default: `False`)
+
     ** Attributes**:
     -------------
     *ptsize* : `int` --
@@ -48,10 +54,13 @@ class VES(object):
 
     *numbatches* : `int` --
         The number of elements in the output vector
+
+    *asarray* : `bool` --
+        Whether the decoded vector is a `numpy.uint64` array
     
  
     """
-    def __init__(self, ptsize, addops, valuesize, vectorsize) -> None:
+    def __init__(self, ptsize, addops, valuesize, vectorsize, asarray=False) -> None:
         super().__init__()
         self.ptsize = ptsize
         self.addops = addops
@@ -60,9 +69,66 @@ class VES(object):
         self.elementsize = valuesize + ceil(log2(addops+1))
         self.compratio = floor(ptsize / self.elementsize)
         self.numbatches = ceil(self.vectorsize / self.compratio)
+        self.asarray = asarray
 
     def encode(self, V):
-        """Encode a vector to a smaller size vector"""
+        """Encode a vector to a smaller size vector
+
+        Elements of at most 64 bits are packed with NumPy: the bits of the elements are laid out in one byte matrix (one row per batch) and each row is converted with `gmpy2.from_binary`."""
+        if self.elementsize > 64:
+            return self._encode(V)
+        V = to_array(V)
+        c = self.compratio
+        nb = ceil(len(V) / c)
+        padded = np.zeros(nb * c, dtype="<u8")
+        padded[:len(V)] = V
+        elements = padded.view(np.uint8).reshape(-1, 8)
+        if self.elementsize % 8 == 0:
+            rows = elements[:, :self.elementsize // 8].reshape(nb, -1)
+        else:
+            bits = np.unpackbits(elements[:, :ceil(self.elementsize / 8)], axis=1, bitorder="little")
+            rows = np.packbits(bits[:, :self.elementsize].reshape(nb, -1), axis=1, bitorder="little")
+        # gmpy2 binary format of a positive mpz: a two bytes header followed by the little-endian magnitude
+        header = np.empty((nb, rows.shape[1] + 2), dtype=np.uint8)
+        header[:, 0] = 1
+        header[:, 1] = 1
+        header[:, 2:] = rows
+        buf = header.tobytes()
+        rb = header.shape[1]
+        return [gmpy2.from_binary(buf[i:i+rb]) for i in range(0, len(buf), rb)]
+
+    def decode(self, E):
+        """decode a vector back to original size vector
+
+        The output has exactly *vectorsize* elements (a `numpy.uint64` array if *asarray* is set). Elements of at most 64 bits are unpacked with NumPy from the `gmpy2.to_binary` representation of the batches."""
+        if self.elementsize > 64:
+            V = self._decode(E)
+            return np.array(V, dtype=object) if self.asarray else V
+        c = self.compratio
+        nb = len(E)
+        rb = ceil(c * self.elementsize / 8)
+        raw = []
+        for e in E:
+            b = gmpy2.to_binary(gmpy2.mpz(e))
+            assert b[1] != 2, "cannot decode a negative value"
+            raw.append(b[2:2+rb].ljust(rb, b'\x00'))
+        rows = np.frombuffer(b''.join(raw), dtype=np.uint8).reshape(nb, rb)
+        elements = np.zeros((nb * c, 8), dtype=np.uint8)
+        if self.elementsize % 8 == 0:
+            b = self.elementsize // 8
+            elements[:, :b] = rows.reshape(nb * c, b)
+        else:
+            bits = np.unpackbits(rows, axis=1, bitorder="little")[:, :c * self.elementsize].reshape(nb * c, self.elementsize)
+            eb = ceil(self.elementsize / 8)
+            padded = np.zeros((nb * c, eb * 8), dtype=np.uint8)
+            padded[:, :self.elementsize] = bits
+            elements[:, :eb] = np.packbits(padded, axis=1, bitorder="little")
+        V = np.zeros(self.vectorsize, dtype=np.uint64)
+        n = min(self.vectorsize, nb * c)
+        V[:n] = elements.view("<u8").reshape(-1)[:n]
+        return V if self.asarray else V.tolist()
+
+    def _encode(self, V):
         bs = self.compratio
         e = []
         E = []
@@ -77,19 +143,19 @@ class VES(object):
             E.append(self._batch(e))
         return E
     
-    def decode(self, E):
-        """decode a vector back to original size vector"""
+    def _decode(self, E):
         V = []
         for e in E: 
             for v in self._debatch(e):
                 V.append(v)
-        return V
+        V = V[:self.vectorsize]
+        return V + [0] * (self.vectorsize - len(V))
 
     def _batch(self,V):
         i = 0
         a = 0
         for v in V:
-            a |= v << self.elementsize*i
+            a |= int(v) << self.elementsize*i
             i+=1 
         return gmpy2.mpz(a)
 
@@ -102,7 +168,7 @@ class VES(object):
             mask <<= 1
             mask |= bit
 
-        while b!=0:
+        for _ in range(self.compratio):
             v = mask & b
             V.append(int(v))
             b >>= self.elementsize
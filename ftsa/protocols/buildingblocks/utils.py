@@ -3,24 +3,205 @@
 
 This module contain additional utility methods used in the building blocks and the protocols"""
 
-import gmpy2, random
+import gmpy2, random, os, threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+BATCH_WORKERS = os.cpu_count() or 1
+"""number of threads used by `batch_powmod` (default: the number of cores)"""
+BATCH_CHUNK = 16
+"""minimum number of exponentiations per thread in `batch_powmod` (default: 16)"""
+
+_batch_pool = None
+_batch_lock = threading.Lock()
+_batch_local = threading.local()
 
 
 def add_vectors(A,B,r):
-    """Adds two vectors mod r"""
+    """Adds two vectors mod r. If one of the vectors is a NumPy array and r is a power of two of at most 64 bits, the result is a `numpy.uint64` array"""
+    if isinstance(A, np.ndarray) or isinstance(B, np.ndarray):
+        if _arraymask(r) is not None:
+            return iadd_vectors(to_array(A).copy(), B, r)
+        A, B = _tolist(A), _tolist(B)
     C=[]
     for a,b in zip(A,B):
         C.append((a+b) % r)
     return C
 
 def subs_vectors(A,B,r):
-    """Substracts two vectors mod r"""
-
+    """Substracts two vectors mod r. If one of the vectors is a NumPy array and r is a power of two of at most 64 bits, the result is a `numpy.uint64` array"""
+    if isinstance(A, np.ndarray) or isinstance(B, np.ndarray):
+        if _arraymask(r) is not None:
+            return isubs_vectors(to_array(A).copy(), B, r)
+        A, B = _tolist(A), _tolist(B)
     C=[]
     for a,b in zip(A,B):
         C.append((a-b) % r)
     return C
 
+def iadd_vectors(A,B,r):
+    """Adds the vector B to the vector A in place mod r and returns A. A `numpy.uint64` array is updated without allocating a new vector when r is a power of two of at most 64 bits (a list A combined with an array B is first converted to a new array)"""
+    mask = _arraymask(r)
+    if isinstance(B, np.ndarray) and mask is not None and not isinstance(A, np.ndarray):
+        A = to_array(A).copy()
+    if isinstance(A, np.ndarray) and mask is not None:
+        assert A.dtype == np.uint64, "in place operations require a numpy.uint64 array"
+        np.add(A, to_array(B), out=A)
+        np.bitwise_and(A, mask, out=A)
+        return A
+    A[:] = add_vectors(_tolist(A), _tolist(B), r)
+    return A
+
+def isubs_vectors(A,B,r):
+    """Substracts the vector B from the vector A in place mod r and returns A. A `numpy.uint64` array is updated without allocating a new vector when r is a power of two of at most 64 bits (a list A combined with an array B is first converted to a new array)"""
+    mask = _arraymask(r)
+    if isinstance(B, np.ndarray) and mask is not None and not isinstance(A, np.ndarray):
+        A = to_array(A).copy()
+    if isinstance(A, np.ndarray) and mask is not None:
+        assert A.dtype == np.uint64, "in place operations require a numpy.uint64 array"
+        np.subtract(A, to_array(B), out=A)
+        np.bitwise_and(A, mask, out=A)
+        return A
+    A[:] = subs_vectors(_tolist(A), _tolist(B), r)
+    return A
+
+def to_array(V):
+    """Returns the vector V as a `numpy.uint64` array (the elements must be lower than \\(2^{64}\\))"""
+    if isinstance(V, np.ndarray) and V.dtype == np.uint64:
+        return V
+    try:
+        return np.asarray(V, dtype=np.uint64)
+    except (TypeError, OverflowError):
+        return np.array([int(v) for v in V], dtype=np.uint64)
+
+def _tolist(V):
+    if isinstance(V, np.ndarray):
+        return V.tolist()
+    return V
+
+def _arraymask(r):
+    # the mask r-1 if r is a power of two which fits in the uint64 arithmetic
+    r = int(r)
+    if r & (r - 1) or r > 2**64:
+        return None
+    return np.uint64(r - 1)
+
+class FixedExponent(object):
+    """An exponent that is recoded once and then applied to many bases (e.g. a user key \\(sk_u\\) for all the elements of all the time periods, or \\(\\Delta^2\\) for all the elements of an aggregated vector)
+
+    The sign and the absolute value are extracted once. `apply` and `apply_many` hand the exponent to gmpy2's `powmod`, which is faster than any recoding done in Python; the sliding window recoding is only used by the multi-exponentiations (see `multipowmod`), where it is computed on first use for each window size and cached.
+    """
+    def __init__(self, e):
+        if isinstance(e, FixedExponent):
+            e = e.e
+        self.e = gmpy2.mpz(e)
+        self.negative = self.e < 0
+        self.magnitude = abs(self.e)
+        self.bits = self.magnitude.bit_length()
+        self._digits = {}
+
+    def __repr__(self):
+        return "<FixedExponent of {} bits>".format(self.bits)
+
+    def digits(self, w):
+        """Returns the sliding window recoding of the absolute value of the exponent with windows of w bits"""
+        d = self._digits.get(w)
+        if d is None:
+            d = _slidingwindow(self.magnitude, w)
+            self._digits[w] = d
+        return d
+
+    def apply(self, base, mod):
+        """Computes base to the power of the exponent modulo *mod*"""
+        return powmod(base, self.e, mod)
+
+    def apply_many(self, bases, mod):
+        """Computes each base to the power of the exponent modulo *mod*. Negative exponents are handled with a single inversion for the whole batch"""
+        if self.magnitude == 0:
+            return [gmpy2.mpz(1)] * len(bases)
+        r = batch_powmod(bases, self.magnitude, mod)
+        if self.negative:
+            r = batchinvert(r, mod)
+        return r
+
+def batchinvert(values, mod):
+    """Finds the inverses of all the values modulo *mod* with a single inversion (Montgomery's trick)"""
+    if not values:
+        return []
+    prefix = []
+    acc = gmpy2.mpz(1)
+    for v in values:
+        acc = acc * v % mod
+        prefix.append(acc)
+    inv = invert(acc, mod)
+    result = [None] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        result[i] = inv * prefix[i-1] % mod
+        inv = inv * values[i] % mod
+    result[0] = inv
+    return result
+
+def multipowmod(bases, exps, mod, window=None):
+    """Computes the product of the bases to the power of the exponents modulo *mod* (simultaneous multi-exponentiation)
+
+    It interleaves the sliding window exponentiations of all the bases (Straus' method) so that all the exponentiations share the same squarings. Negative exponents are accumulated separately and handled with a single inversion at the end. The exponents can be given as `FixedExponent` to reuse their recoding across calls."""
+
+    exps = [e if isinstance(e, FixedExponent) else FixedExponent(e) for e in exps]
+    nbits = max([e.bits for e in exps] + [1])
+    w = window or _window(nbits)
+
+    # for each bit position, the precomputed powers to multiply with
+    schedule = {}
+    negative = False
+    for b, e in zip(bases, exps):
+        if e.bits == 0 or b == 1:
+            continue
+        sign = 0
+        if e.negative:
+            sign = 1
+            negative = True
+        digits = e.digits(w)
+        table = _oddpowers(b, max(d for _, d in digits), mod)
+        for pos, d in digits:
+            schedule.setdefault(pos, []).append((sign, table[d >> 1]))
+
+    acc = [gmpy2.mpz(1), gmpy2.mpz(1)]
+    for pos in range(max(schedule, default=-1), -1, -1):
+        acc[0] = acc[0] * acc[0] % mod
+        if negative:
+            acc[1] = acc[1] * acc[1] % mod
+        for sign, t in schedule.get(pos, ()):
+            acc[sign] = acc[sign] * t % mod
+    if negative:
+        return acc[0] * invert(acc[1], mod) % mod
+    return acc[0] % mod
+
+def _window(nbits):
+    # the window size minimizing the table size plus the number of multiplications
+    return min(range(1, 11), key=lambda w: 2**(w-1) + nbits / (w+1))
+
+def _slidingwindow(e, w):
+    # recodes e >= 0 into (position, odd digit) pairs such that e = sum(d * 2**position)
+    digits = []
+    e = gmpy2.mpz(e)
+    mask = (1 << w) - 1
+    i = gmpy2.bit_scan1(e, 0)
+    while i is not None:
+        digits.append((i, int((e >> i) & mask)))
+        i = gmpy2.bit_scan1(e, i + w)
+    return digits
+
+def _oddpowers(b, dmax, mod):
+    # returns [b, b^3, b^5, ..., b^dmax] modulo mod
+    b = b % mod
+    table = [b]
+    if dmax > 1:
+        b2 = b * b % mod
+        for _ in range(dmax >> 1):
+            table.append(table[-1] * b2 % mod)
+    return table
+
 def getprimeover(bits):
     """Returns a prime number with specific number of bits """
 
@@ -48,6 +229,171 @@ def powmod(a, b, c):
         return 1
     return gmpy2.powmod(a, b, c)
 
+def set_batch_workers(workers):
+    """Sets the number of threads used by `batch_powmod` (1 disables the thread pool)"""
+    global BATCH_WORKERS, _batch_pool
+    with _batch_lock:
+        BATCH_WORKERS = max(1, workers)
+        if _batch_pool is not None:
+            _batch_pool.shutdown(wait=False)
+            _batch_pool = None
+
+def batch_powmod(bases, exps, mod):
+    """Computes each base to the power of the exponent (a single exponent, or a list with one exponent per base) modulo *mod*
+
+    The batch is split in chunks computed by a pool of `BATCH_WORKERS` threads. gmpy2's list based functions (`powmod_base_list`) release the GIL, hence the chunks run on all the cores of a single process. When they are not available, the chunks fall back to per-element `powmod` calls (with the gmpy2 context allowed to release the GIL)."""
+
+    n = len(bases)
+    if isinstance(exps, list) and len(exps) != n:
+        raise ValueError("the number of bases and exponents differ")
+    workers = BATCH_WORKERS
+    if workers <= 1 or n < 2 * BATCH_CHUNK or getattr(_batch_local, "worker", False):
+        return _powmod_chunk(bases, exps, mod)
+
+    size = max(BATCH_CHUNK, -(-n // workers))
+    pool = _batch_executor()
+    futures = []
+    for i in range(0, n, size):
+        e = exps[i:i+size] if isinstance(exps, list) else exps
+        futures.append(pool.submit(_powmod_worker, bases[i:i+size], e, mod))
+    result = []
+    for f in futures:
+        result.extend(f.result())
+    return result
+
+def batch_map(fn, items):
+    """Applies fn to each item with the pool of `BATCH_WORKERS` threads and returns the list of results. It is meant for functions that release the GIL (AES, NumPy or gmpy2 batches); with a single worker, or from a worker thread, the items are processed inline"""
+    items = list(items)
+    if BATCH_WORKERS <= 1 or len(items) < 2 or getattr(_batch_local, "worker", False):
+        return [fn(item) for item in items]
+    pool = _batch_executor()
+    return [f.result() for f in [pool.submit(_map_worker, fn, item) for item in items]]
+
+def _map_worker(fn, item):
+    _batch_local.worker = True
+    return fn(item)
+
+def _batch_executor():
+    global _batch_pool
+    with _batch_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPoolExecutor(BATCH_WORKERS)
+        return _batch_pool
+
+def _powmod_worker(bases, exps, mod):
+    # a batch started from a worker thread is computed inline (no nested waits on the pool)
+    _batch_local.worker = True
+    context = gmpy2.get_context()
+    if hasattr(context, "allow_release_gil"):
+        context.allow_release_gil = True
+    return _powmod_chunk(bases, exps, mod)
+
+def _powmod_chunk(bases, exps, mod):
+    if not isinstance(exps, list):
+        if hasattr(gmpy2, "powmod_base_list"):
+            return gmpy2.powmod_base_list(bases, exps, mod)
+        exps = [exps] * len(bases)
+    return [powmod(b, e, mod) for b, e in zip(bases, exps)]
+
+def _reset_batch_pool():
+    # the threads of the pool do not survive a fork
+    global _batch_pool, _batch_lock
+    _batch_pool = None
+    _batch_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_batch_pool)
+
+
+
+class LagrangeCache(object):
+    """A bounded cache of the Lagrange coefficients (for an interpolation at 0) keyed by the field (or the factor \\(\\Delta\\) for the integers) and the set of participant indices.
+
+    Across FL rounds the set of participants usually repeats, hence the coefficients are computed once. On a miss, the numerators are obtained from prefix and suffix products of the indices and the field denominators are inverted with a single inversion, so each coefficient costs \\(O(k)\\) operations.
+
+    ## **Args**:
+    -------------
+    *maxsize* : `int` --
+        The maximum number of participant sets kept in the cache (default: 64)
+    """
+    def __init__(self, maxsize=64) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def field(self, Field, indices):
+        """Returns the Lagrange coefficients over the field *Field* as a dictionary `{Field(idx) : Field(coef)}`"""
+        key = (Field, frozenset(indices))
+        coefs = self._get(key)
+        if coefs is None:
+            p = Field(0).p
+            indices = [i % p for i in indices]
+            num = _products_but_one(indices, p)
+            den = []
+            for x_j in indices:
+                d = 1
+                for x_m in indices:
+                    if x_m != x_j:
+                        d = d * (x_m - x_j) % p
+                den.append(d)
+            den = batchinvert(den, p)
+            coefs = {Field(x_j): Field(n * d % p) for x_j, n, d in zip(indices, num, den)}
+            self._put(key, coefs)
+        return coefs
+
+    def integer(self, delta, indices):
+        """Returns the Lagrange coefficients over the integers multiplied by \\(\\Delta\\) as a dictionary `{idx : coef}`"""
+        key = (delta, frozenset(indices))
+        coefs = self._get(key)
+        if coefs is None:
+            num = _products_but_one(indices)
+            coefs = {}
+            for x_j, n in zip(indices, num):
+                d = 1
+                for x_m in indices:
+                    if x_m != x_j:
+                        d *= x_m - x_j
+                coefs[x_j] = (delta * n) // d
+            self._put(key, coefs)
+        return coefs
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._cache.clear()
+
+    def _get(self, key):
+        with self._lock:
+            coefs = self._cache.get(key)
+            if coefs is not None:
+                self._cache.move_to_end(key)
+            return coefs
+
+    def _put(self, key, coefs):
+        with self._lock:
+            self._cache[key] = coefs
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+def _products_but_one(values, mod=None):
+    # for each j, the product of all the values except the j-th one
+    k = len(values)
+    prefix = [1] * (k + 1)
+    suffix = [1] * (k + 1)
+    for j in range(k):
+        prefix[j+1] = prefix[j] * values[j]
+        suffix[k-j-1] = suffix[k-j] * values[k-j-1]
+        if mod is not None:
+            prefix[j+1] %= mod
+            suffix[k-j-1] %= mod
+    r = [prefix[j] * suffix[j+1] for j in range(k)]
+    if mod is not None:
+        r = [x % mod for x in r]
+    return r
+
+LAGRANGE_CACHE = LagrangeCache()
+"""the Lagrange coefficient cache shared by the secret sharing schemes"""
 
 
 class PField(object):
@@ -150,3 +496,71 @@ class P64Field(PField):
     bits = 64
     def __init__(self, encoded_value):
         super().__init__(encoded_value,2**65 - 493, P64Field.bits)
+
+
+class FieldVector(object):
+    """A vector of elements of \\(\\mathbb{Z}_p\\) stored as raw `gmpy2.mpz` values.
+
+    It is a struct-of-arrays alternative to a list of `PField` elements: the operations work on the whole vector and do not allocate a field object per element.
+
+    ## **Args**:
+    -------------
+    *values* : `list` --
+        The elements of the vector (integers)
+
+    *p* : `int` --
+        The prime \\(p\\)
+
+    ## **Attributes**:
+    -------------
+    *values* : `list` --
+        The elements of the vector as `gmpy2.mpz` values in \\([0, p)\\)
+
+    *p* : `gmpy2.mpz` --
+        The prime \\(p\\)
+    """
+    def __init__(self, values, p) -> None:
+        super().__init__()
+        self.p = gmpy2.mpz(p)
+        self.values = [gmpy2.mpz(v) % self.p for v in values]
+
+    @staticmethod
+    def random(size, p, nbytes):
+        """Returns a vector of *size* random elements of *nbytes* bytes each, drawn with a single call to the randomness source"""
+        buf = os.urandom(size * nbytes)
+        return FieldVector([int.from_bytes(buf[i:i+nbytes], "big") for i in range(0, size * nbytes, nbytes)], p)
+
+    @staticmethod
+    def lincomb(coefs, vectors, p):
+        """Returns the linear combination \\(\\sum_j c_j \\cdot V_j \\mod p\\) of the vectors (a matrix-vector product), reducing each element once"""
+        size = len(vectors[0])
+        acc = [0] * size
+        for c, V in zip(coefs, vectors):
+            assert len(V) == size, "vectors of different lengths"
+            c = gmpy2.mpz(c)
+            acc = [a + c * v for a, v in zip(acc, V.values)]
+        return FieldVector(acc, p)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __add__(self, other):
+        if isinstance(other, FieldVector):
+            assert len(self) == len(other), "vectors of different lengths"
+            return FieldVector([a + b for a, b in zip(self.values, other.values)], self.p)
+        return FieldVector([a + other for a in self.values], self.p)
+
+    def __mul__(self, other):
+        if isinstance(other, FieldVector):
+            assert len(self) == len(other), "vectors of different lengths"
+            return FieldVector([a * b for a, b in zip(self.values, other.values)], self.p)
+        other = gmpy2.mpz(other)
+        return FieldVector([a * other for a in self.values], self.p)
+
+    __rmul__ = __mul__
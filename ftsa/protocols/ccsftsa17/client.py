@@ -4,11 +4,12 @@ from ecdsa import keys
 from ecdsa.curves import SECP112r1
 import gmpy2
 
-from ftsa.protocols.buildingblocks.utils import add_vectors, subs_vectors
+from ftsa.protocols.buildingblocks.utils import add_vectors, iadd_vectors, isubs_vectors
 from ftsa.protocols.buildingblocks.PRG import PRG
 from ftsa.protocols.buildingblocks.ShamirSS import SSS, Share
 from ftsa.protocols.buildingblocks.KeyAggreement import KAS
-from ftsa.protocols.buildingblocks.AESGCM128 import EncryptionKey as AESKEY
+from ftsa.protocols.utils.WireCodec import WireCodec
+from ftsa.protocols.buildingblocks.AESGCM128 import ChannelSessions
 
 
 
@@ -35,6 +36,9 @@ class Client(object):
     *ckeys* : `dict` --
         A channel encryption key for each communication channel with each other user {v : key}
 
+    *channels* : `ChannelSessions` --
+        The channel sessions with each other user (built from *ckeys*)
+
     *U1* : `list` --
         Set of round 1 users' identifiers
 
@@ -88,6 +92,8 @@ class Client(object):
     """the secret sharing scheme for sharing the blinding mask"""
     SSsk = SSS(keysize) # t-out-of-n SS for the deffie-hellman secret key
     """the secret sharing scheme for sharing the user mask"""
+    WC = WireCodec(field=SSb.Field, keyfield=SSsk.Field, valuesize=expandedvaluesize)
+    """the wire codec of the messages"""
 
 
     def __init__(self, user) -> None:
@@ -96,6 +102,7 @@ class Client(object):
         self.step = 1 # the Fl step.
         self.key = [0]*Client.dimension # the user masking key 
         self.ckeys = {} # a channel encryption key for each communication channel with each other user {v : key}
+        self.channels = ChannelSessions(user) # the channel sessions with each other user
         self.U1 = [] # set of round 1 users
         self.U2 = [] # set of round 2 users
         self.U4 = [] # set of round 4 users
@@ -108,7 +115,7 @@ class Client(object):
         self.alldhpks = {} # received DH public keys 
 
     @staticmethod
-    def set_scenario(dimension, valuesize, keysize, threshold, nclients):
+    def set_scenario(dimension, valuesize, keysize, threshold, nclients, asarray=False):
         """Sets up the parameters of the protocol."""
         Client.dimension = dimension
         Client.valuesize = valuesize
@@ -117,9 +124,10 @@ class Client(object):
         Client.keysize = keysize
         Client.threshold = threshold
         Client.Uall = [i+1 for i in range(nclients)]
-        Client.prg = PRG(dimension, valuesize)
+        Client.prg = PRG(dimension, valuesize, asarray)
         Client.SSb = SSS(PRG.security)
         Client.SSsk = SSS(keysize)
+        Client.WC = WireCodec(field=Client.SSb.Field, keyfield=Client.SSsk.Field, valuesize=Client.expandedvaluesize, asarray=asarray)
 
     def new_fl_step(self):
         """Starts a new FL round. 
@@ -135,6 +143,7 @@ class Client(object):
         self.KAs= KAS() 
         self.KAc= KAS() 
         self.ckeys = {}
+        self.channels = ChannelSessions(self.user)
         self.b = 0
         self.alldhpks = {}
         self.key = [0]*Client.dimension
@@ -185,11 +194,9 @@ class Client(object):
         self.U1 += list(alldhpks.keys())
 
         # for each user compute agreed key
-        for vuser in alldhpkc:
-            if vuser == self.user:
-                continue
-            # compute channel key
-            self.ckeys[vuser] = self.KAc.agree(alldhpkc[vuser])
+        self.ckeys.update(self.KAc.agree_many({vuser : alldhpkc[vuser] for vuser in alldhpkc if vuser != self.user}))
+        for vuser in self.ckeys:
+            self.channels.add(vuser, self.ckeys[vuser])
 
 
         # sample a random element b
@@ -203,7 +210,7 @@ class Client(object):
         kshares = Client.SSsk.share(self.threshold, self.nclients, self.KAs.get_sk_bytes())
 
         # encrypt the shares for each user
-        E = {}
+        messages = {}
         for kshare, bshare in zip(kshares, bshares):
             assert kshare.idx == bshare.idx
             vuser = kshare.idx
@@ -211,11 +218,9 @@ class Client(object):
                 self.keyshares[self.user] = kshare
                 self.bshares[self.user] = bshare
                 continue
-            key = AESKEY(self.ckeys[vuser])
-            sharelen = len(gmpy2.to_binary(kshare.value._value))
-            message = self.user.to_bytes(2,"big") + vuser.to_bytes(2,"big") + sharelen.to_bytes(2,"big") + gmpy2.to_binary(kshare.value._value) + gmpy2.to_binary(bshare.value._value)
-            e = key.encrypt(message)
-            E[vuser] = e
+            kbytes = gmpy2.to_binary(kshare.value._value)
+            messages[vuser] = len(kbytes).to_bytes(2,"big") + kbytes + gmpy2.to_binary(bshare.value._value)
+        E = self.channels.encrypt_many(messages)
 
         self.alldhpks = alldhpks
      
@@ -239,15 +244,14 @@ class Client(object):
         self.eshares = eshares
 
         # for each user compute masking agreed key
-        for vuser in self.alldhpks:
-            if vuser == self.user:
-                continue
+        svs = self.KAs.agree_many({vuser : self.alldhpks[vuser] for vuser in self.alldhpks if vuser != self.user})
+        for vuser in svs:
             # compute masking key
-            sv = self.KAs.agree(self.alldhpks[vuser])
+            sv = svs[vuser]
             if vuser > self.user:
-                self.key = subs_vectors(self.key, Client.prg.eval(sv), 2**Client.expandedvaluesize)
+                self.key = isubs_vectors(self.key, Client.prg.eval(sv), 2**Client.expandedvaluesize)
             else:
-                self.key = add_vectors(self.key, Client.prg.eval(sv), 2**Client.expandedvaluesize)
+                self.key = iadd_vectors(self.key, Client.prg.eval(sv), 2**Client.expandedvaluesize)
         
         # extend b using PRG
         B = Client.prg.eval(self.b)
@@ -276,15 +280,12 @@ class Client(object):
         self.U4 = U4
 
         # decrypt the shares
-        for vuser in self.eshares: 
-            key = AESKEY(self.ckeys[vuser])
-            message = key.decrypt(self.eshares[vuser])
-            u = int.from_bytes(message[:2],"big")
-            v = int.from_bytes(message[2:4],"big")
-            sharelen = int.from_bytes(message[4:6],"big")
-            assert v == self.user and u == vuser, "invalid encrypted message"
-            kshare = gmpy2.from_binary(message[6:sharelen+6])
-            bshare = gmpy2.from_binary(message[sharelen+6:])
+        messages = self.channels.decrypt_many(self.eshares)
+        for vuser in messages: 
+            message = messages[vuser]
+            sharelen = int.from_bytes(message[:2],"big")
+            kshare = gmpy2.from_binary(message[2:sharelen+2])
+            bshare = gmpy2.from_binary(message[sharelen+2:])
             self.bshares[vuser] = Share(self.user, Client.SSb.Field(bshare))
             self.keyshares[vuser] = Share(self.user, Client.SSsk.Field(kshare))
 
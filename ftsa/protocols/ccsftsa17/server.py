@@ -1,10 +1,13 @@
 from collections import defaultdict
 from math import ceil, log2
 
-from ftsa.protocols.buildingblocks.utils import subs_vectors, add_vectors
+from ftsa.protocols.buildingblocks.utils import iadd_vectors
 from ftsa.protocols.buildingblocks.PRG import PRG
 from ftsa.protocols.buildingblocks.ShamirSS import SSS
 from ftsa.protocols.buildingblocks.KeyAggreement import KAS
+from ftsa.protocols.utils.WireCodec import WireCodec
+from ftsa.protocols.utils.PhaseCollector import PhaseCollector
+from ftsa.protocols.utils.Router import Router
 
 
 
@@ -29,6 +32,9 @@ class Server(object):
     *U5* : `list` --
         Set of round 4 users' identifiers
 
+    *phase* : `PhaseCollector` --
+        The collector of the messages of the current round (see `open_phase`)
+
     *allY* : `list` --
         The list of all user's protected inputs
 
@@ -56,6 +62,8 @@ class Server(object):
     """the secret sharing scheme for sharing the blinding mask"""
     SSsk = SSS(keysize) # t-out-of-n SS for the deffie-hellman secret key
     """the secret sharing scheme for sharing the user mask"""
+    WC = WireCodec(field=SSb.Field, keyfield=SSsk.Field, valuesize=expandedvaluesize)
+    """the wire codec of the messages"""
 
     def __init__(self) -> None:
         super().__init__()
@@ -66,9 +74,10 @@ class Server(object):
         self.U5 = [] # set of round 4 users
         self.alldhpks = {} # received DH public keys 
         self.allY = {} # all masked inputs
+        self.phase = None # the collector of the messages of the current round
 
     @staticmethod
-    def set_scenario(dimension, valuesize, keysize, threshold, nclients):
+    def set_scenario(dimension, valuesize, keysize, threshold, nclients, asarray=False):
         """Sets up the parameters of the protocol."""
         Server.dimension = dimension
         Server.valuesize = valuesize
@@ -76,9 +85,10 @@ class Server(object):
         Server.expandedvaluesize = valuesize + ceil(log2(nclients))
         Server.keysize = keysize
         Server.threshold = threshold
-        Server.prg = PRG(dimension, valuesize)
+        Server.prg = PRG(dimension, valuesize, asarray)
         Server.SSb = SSS(PRG.security)
         Server.SSsk = SSS(keysize)
+        Server.WC = WireCodec(field=Server.SSb.Field, keyfield=Server.SSsk.Field, valuesize=Server.expandedvaluesize, asarray=asarray)
 
     def new_fl_step(self):
         """Starts a new FL round. 
@@ -91,6 +101,25 @@ class Server(object):
         self.U5 = []
         self.allY = {} 
     
+    def open_phase(self, users=None, deadline=None):
+        """Opens the collection of the messages of a round. The messages are submitted to the returned `PhaseCollector` as they arrive; the round is closed when all the users answered or, at the deadline, when at least *threshold* users answered, and the users who did not answer are dropped.
+
+        ** Args **:
+        -----------
+        *users* : `list` -- 
+            The users expected to answer (default: the users of the last round, or all the users)
+
+        *deadline* : `float` -- 
+            The duration of the round in seconds (default: `None`, wait for all the users)
+
+        **Returns**: 
+        ----------------
+        The collector of the round (type: `PhaseCollector`)
+        """
+        users = users or self.U3 or self.U2 or self.U1 or range(1, Server.nclients + 1)
+        self.phase = PhaseCollector(users, Server.threshold, deadline)
+        return self.phase
+
     def advertise_keys(self, alldhpks, alldhpkc):
         """Round 0 - AdvertiseKeys: Server forwards advertised keys. 
         
@@ -122,22 +151,21 @@ class Server(object):
         ** Args **:
         -----------
         *allekshares* : `dict`
-            The list of encrypted share generated by each user
+            The encrypted shares generated by each user (a dictionary or its encoded SHARES frame)
 
         **Returns**: 
         ----------------
-        A list of encrypted shares destined to each user (type: `dict`)
+        The mailboxes of the encrypted shares destined to each user (type: `Router`, each user pulls its SHARES frame with `Router.pull`)
         """
         self.U2 = list(allekshares.keys())
 
         assert len(self.U2) >= Server.threshold
 
 
-        # prepare eshares for each corresponding user
-        ekshares = defaultdict(dict)
+        # route the eshares to the mailbox of each corresponding user
+        ekshares = Router()
         for user in allekshares:
-            for vuser in allekshares[user]:
-                ekshares[vuser][user] = allekshares[user][vuser]
+            ekshares.post(user, allekshares[user])
         
         # send the encrypted key shares for each corresponding user
         return ekshares
@@ -204,16 +232,12 @@ class Server(object):
         for user in allbshares:
             for vuser in allbshares[user]:
                 bshares[vuser].append(allbshares[user][vuser])
-        lagcoef = []
-        b = {}
-        B = defaultdict(list)
-        for vuser in bshares:
-            assert len(bshares[vuser]) >= Server.threshold
-            if not lagcoef:
-                lagcoef = Server.SSb.lagrange(bshares[vuser])
-            b[vuser] = Server.SSb.recon(bshares[vuser],lagcoef)
-            # recompute the blinding vector B
-            B[vuser] = Server.prg.eval(b[vuser])
+        assert all(len(bshares[vuser]) >= Server.threshold for vuser in bshares)
+        # the seeds held by the same users are reconstructed in one batch
+        b = Server.SSb.recon_users(bshares)
+        # the blinding vectors B are substracted
+        seeds = list(b.values())
+        signs = [-1] * len(b)
 
 
         # reconstruct the dh key for each dead user 
@@ -222,39 +246,27 @@ class Server(object):
             for vuser in allkshares[user]:
                 kshares[vuser].append(allkshares[user][vuser])
         dhkey = {}
-        lagcoef = []
-        for vuser in kshares:
-            assert len(kshares[vuser]) >= Server.threshold
-            if not lagcoef:
-                lagcoef = Server.SSsk.lagrange(kshares[vuser])
-            k = Server.SSsk.recon(kshares[vuser],lagcoef)
-            k = int(k)
+        assert all(len(kshares[vuser]) >= Server.threshold for vuser in kshares)
+        allk = Server.SSsk.recon_users(kshares)
+        for vuser in allk:
+            k = int(allk[vuser])
             dhkey[vuser] = KAS().generate_from_bytes(k.to_bytes(Server.keysize // 8, "big"))
 
         # recompute their masking agreed keys 
-        skey = {}
         for user in self.U2:
             if user in self.U3:
                 continue
-            key = [0] * Server.dimension
-            for vuser in self.alldhpks:
-                if vuser == user:
-                    continue
-                sv = dhkey[user].agree(self.alldhpks[vuser])
-                if vuser > user:
-                    key = subs_vectors(key, Server.prg.eval(sv), 2**Server.expandedvaluesize)
-                else:
-                    key = add_vectors(key, Server.prg.eval(sv), 2**Server.expandedvaluesize)
-            
-            skey[user] = key
+            svs = dhkey[user].agree_many({vuser : self.alldhpks[vuser] for vuser in self.alldhpks if vuser != user})
+            for vuser, sv in svs.items():
+                seeds.append(sv)
+                signs.append(-1 if vuser > user else 1)
 
         # decrypt the masks
         result = [0] * Server.dimension
         for user in self.allY:
-            result = add_vectors(result, self.allY[user], 2**Server.expandedvaluesize) 
-        for user in skey:
-            result = add_vectors(result, skey[user], 2**Server.expandedvaluesize) 
-        for user in B:
-            result = subs_vectors(result, B[user], 2**Server.expandedvaluesize) 
+            result = iadd_vectors(result, self.allY[user], 2**Server.expandedvaluesize) 
+        # all the masks are expanded and summed in one pass
+        if seeds:
+            result = iadd_vectors(result, Server.prg.eval_sum(seeds, signs, 2**Server.expandedvaluesize), 2**Server.expandedvaluesize)
         
         return result
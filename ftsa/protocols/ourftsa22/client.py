@@ -1,15 +1,20 @@
 import random
 from math import ceil
 import gmpy2
+import numpy as np
 
 from ftsa.protocols.buildingblocks.utils import add_vectors
 from ftsa.protocols.buildingblocks.PRG import PRG
 from ftsa.protocols.buildingblocks.ShamirSS import SSS, Share
 from ftsa.protocols.buildingblocks.IntegerSS import IShare
 from ftsa.protocols.buildingblocks.JoyeLibert import TJLS, UserKey
+from ftsa.protocols.buildingblocks.MaskPrecomputation import MaskPrecomputer
+from ftsa.protocols.buildingblocks.ParallelEncryption import EncryptionPool
 from ftsa.protocols.buildingblocks.VectorEncoding import VES
+from ftsa.protocols.buildingblocks.FixedPointEncoding import FPES
 from ftsa.protocols.buildingblocks.KeyAggreement import KAS
-from ftsa.protocols.buildingblocks.AESGCM128 import EncryptionKey as AESKEY
+from ftsa.protocols.buildingblocks.AESGCM128 import ChannelSessions
+from ftsa.protocols.utils.WireCodec import WireCodec
 
 
 
@@ -36,6 +41,9 @@ class Client(object):
     *ckeys* : `dict` --
         A channel encryption key for each communication channel with each other user {v : key}
 
+    *channels* : `ChannelSessions` --
+        The channel sessions with each other user (built from *ckeys*)
+
     *U* : `list` --
         Set of registered user identifiers
 
@@ -69,6 +77,10 @@ class Client(object):
     """threshold for secret sharing scheme (default: 2/3 of the nb. of clients)"""
     Uall = [i+1 for i in range(nclients)] # set of all user identifiers
     """set of all user identifiers"""
+    maskrounds = 0 # number of rounds to precompute the TJL masks for
+    """number of upcoming rounds whose TJL masks are precomputed in background, it cannot be combined with `workers` (default: 0, disabled)"""
+    workers = 0 # number of processes encrypting the input
+    """number of processes sharing the encryption of the input and the sharing of the TJL key, the mask seed sharing overlaps with them (default: 0, disabled)"""
 
     # init the building blocks
     VE = VES(keysize // 2, nclients, valuesize, dimension)
@@ -81,6 +93,10 @@ class Client(object):
     """the pseudo-random generator"""
     SS = SSS(PRG.security)
     """the secret sharing scheme"""
+    FP = None
+    """the fixed-point encoding scheme of real-valued inputs (default: None, the inputs are integers)"""
+    WC = WireCodec(pp, SS.Field)
+    """the wire codec of the messages"""
 
     def __init__(self, user) -> None:
         super().__init__()
@@ -88,6 +104,7 @@ class Client(object):
         self.step = 0 # the Fl step.
         self.key = gmpy2.mpz(0) # the user encryption key for JL
         self.ckeys = {} # a channel encryption key for each communication channel with each other user {v : key}
+        self.channels = ChannelSessions(user) # the channel sessions with each other user
         self.U = [] # set of registered user identifiers
         self.Ualive = [] # set of alive users' identifiers 
         self.bshares = {} # a share of the b value of each other user {v : bshare}
@@ -95,9 +112,11 @@ class Client(object):
         self.X = [] # the user input vector
         self.KAs= KAS() # DH KA scheme for computing JL key
         self.KAc= KAS() # DH KA scheme for computing channel key
+        self.encpool = None # the pool of processes encrypting the input (see `workers`)
+        self.recovery = (0, 0) # progress of the protection of the zero-value (done, total)
 
     @staticmethod
-    def set_scenario(dimension, valuesize, keysize, threshold, nclients, publicparam):
+    def set_scenario(dimension, valuesize, keysize, threshold, nclients, publicparam, maskrounds=0, asarray=False, clip=None, workers=0):
         """Sets up the parameters of the protocol."""
         Client.dimension = dimension
         Client.valuesize = valuesize
@@ -105,22 +124,31 @@ class Client(object):
         Client.keysize = keysize
         Client.threshold = threshold
         Client.Uall = [i+1 for i in range(nclients)]
-        Client.VE = VES(keysize // 2, nclients, valuesize, dimension)
-        Client.TJL = TJLS(nclients,threshold, Client.VE)
+        # the encryption workers compute the masks themselves, the precomputed ones would never be used
+        assert not (maskrounds and workers > 1), "the masks precomputation and the encryption workers cannot be combined"
+        Client.maskrounds = maskrounds
+        Client.workers = workers
+        Client.VE = VES(keysize // 2, nclients, valuesize, dimension, asarray)
+        Client.TJL = TJLS(nclients,threshold, Client.VE, workers=max(workers, 1))
         Client.TJL.Setup(keysize) 
         Client.pp = publicparam
-        Client.prg = PRG(dimension, valuesize)
+        Client.prg = PRG(dimension, valuesize, asarray)
         Client.SS = SSS(PRG.security)
+        Client.FP = FPES(valuesize, clip) if clip else None
+        Client.WC = WireCodec(publicparam, Client.SS.Field)
 
-    def new_fl_step(self):
+    def new_fl_step(self, X=None):
         """Starts a new FL round. 
         
-        It increments the round counter and regenrates a new random input (This should be replaced with the actual training of the model)."""
+        It increments the round counter and sets the user input to X (e.g. the model update, possibly a `numpy.memmap`). If X is not given, it regenrates a new random input (This should be replaced with the actual training of the model). A real-valued input is quantized with the fixed-point encoding scheme when it is protected (chunk by chunk in the streaming mode)."""
         self.step += 1
         self.Ualive = []
         self.bshares = {}
-        # generate a new input vector
-        self.X = [random.SystemRandom().getrandbits(Client.valuesize) for _ in range(Client.dimension)]
+        if X is None:
+            # generate a new input vector
+            self.X = [random.SystemRandom().getrandbits(Client.valuesize) for _ in range(Client.dimension)]
+        else:
+            self.X = X
                 
     def setup_register(self):
         """Setup phase - Register: User registers to te server. 
@@ -164,18 +192,21 @@ class Client(object):
         assert _setlen(alldhpkc.values()) == len(alldhpkc.values())  
         assert _setlen(alldhpks.values()) == len(alldhpks.values())  
 
+        # stop the services of a previous key
+        self.close()
+        self.key = gmpy2.mpz(0)
+
         # for each user compute agreed key
-        for vuser in alldhpkc:
-            if vuser == self.user:
-                continue
-            
+        peers = [vuser for vuser in alldhpkc if vuser != self.user]
+        self.ckeys.update(self.KAc.agree_many({vuser : alldhpkc[vuser] for vuser in peers}))
+        for vuser in peers:
+            self.channels.add(vuser, self.ckeys[vuser])
+        svs = self.KAs.agree_many({vuser : alldhpks[vuser] for vuser in peers}, Client.keysize)
+        for vuser in peers:
             self.U.append(vuser)
 
-            # compute channel key
-            self.ckeys[vuser] = self.KAc.agree(alldhpkc[vuser])
-            
             # compute JL key
-            sv = self.KAs.agree(alldhpks[vuser], Client.keysize)
+            sv = svs[vuser]
             if vuser > self.user:
                 self.key -= sv
             else:
@@ -183,20 +214,27 @@ class Client(object):
 
         self.key = UserKey(Client.pp, self.key)
 
+        # precompute the masks of the first rounds while waiting for the other users
+        if Client.maskrounds:
+            self.key.masks = MaskPrecomputer(self.key, Client.VE.numbatches, Client.maskrounds)
+            self.key.masks.schedule(self.step + 1)
+
+        # start the encryption workers (they receive the key once)
+        if Client.workers > 1:
+            self.encpool = EncryptionPool(self.key, Client.workers)
+
         # generate t-out-of-n shares of JL key
         shares = Client.TJL.SKShare(self.key, self.threshold, self.U)
         
         # encrypt the shares for each user
-        E = {}
+        messages = {}
         for share in shares:
             vuser = share.idx
             if self.user == vuser:
                 self.keyshares[self.user] = share
                 continue
-            key = AESKEY(self.ckeys[vuser])
-            message = self.user.to_bytes(2,"big") + vuser.to_bytes(2,"big") + gmpy2.to_binary(share.value)
-            e = key.encrypt(message)
-            E[vuser] = e
+            messages[vuser] = gmpy2.to_binary(share.value)
+        E = self.channels.encrypt_many(messages)
         
         # send the user id and the encrypted shares
         return self.user, E
@@ -214,13 +252,9 @@ class Client(object):
         assert len(eshares) + 1 >= self.threshold
     
         # set the registered users and decrypt the shares
-        for vuser in eshares: 
-            key = AESKEY(self.ckeys[vuser])
-            message = key.decrypt(eshares[vuser])
-            u = int.from_bytes(message[:2],"big")
-            v = int.from_bytes(message[2:4],"big")
-            assert v == self.user and u == vuser, "invalid encrypted message" 
-            share = gmpy2.from_binary(message[4:])
+        messages = self.channels.decrypt_many(eshares)
+        for vuser in messages: 
+            share = gmpy2.from_binary(messages[vuser])
             self.keyshares[vuser] = IShare(self.user, share)
         return 
 
@@ -240,29 +274,77 @@ class Client(object):
         B = Client.prg.eval(b)
 
         # encrypt the message
-        XplusB = add_vectors(self.X,B,2**(Client.VE.elementsize))
-        Y = Client.TJL.Protect(Client.pp, self.key, self.step, XplusB)
+        XplusB = add_vectors(self._input(),B,2**(Client.VE.elementsize))
+        if self.encpool is not None:
+            # the workers encrypt the encoded input while the shares of b are generated
+            Y = self.encpool.submit(Client.VE.encode(XplusB), self.step)
+            E = self._share_seed(b)
+            Y = Y.result()
+        else:
+            Y = Client.TJL.Protect(Client.pp, self.key, self.step, XplusB)
+            E = self._share_seed(b)
+
+        # precompute the masks of the next rounds in background
+        if self.key.masks is not None:
+            self.key.masks.schedule(self.step + 1)
 
+        # send user id, encrypted shares, and the encrypted input
+        return self.user, E, Y
+
+    def online_encrypt_stream(self, slots=1024):
+        """Online phase - Encrypt (streaming mode): User protect its input chunk by chunk and sends the chunks to the server as they are produced. 
+        
+        It behaves as `online_encrypt` but the input vector is processed in chunks of *slots* encoded elements (ciphertexts): each chunk of the input (which can be a `numpy.memmap`) is read, masked with the matching range of the PRG output, encoded and protected with the element counters offset by the index of its first encoded element. Hence, the peak memory is bounded by the chunk size.
+        
+        **Returns**: 
+        ----------------
+        The user identifier, a dictionary of encryptes shares of its mask seed, and a generator of the protected chunks as pairs (offset, `CiphertextVector`) (type: (`int`, `dict`, `generator`)."""
+
+        # sample a random element b
+        b = random.SystemRandom().getrandbits(PRG.security)
+
+        # send user id, encrypted shares, and the encrypted input chunks
+        return self.user, self._share_seed(b), self._protect_chunks(b, slots)
+
+    def _protect_chunks(self, b, slots):
+        size = slots * Client.VE.compratio
+        for start in range(0, Client.dimension, size):
+            stop = min(start + size, Client.dimension)
+            offset = start // Client.VE.compratio
+            XplusB = add_vectors(self._input(start, stop), Client.prg.eval(b, start, stop), 2**(Client.VE.elementsize))
+            yield offset, Client.TJL.Protect(Client.pp, self.key, self.step, XplusB, offset)
+
+    def close(self):
+        """Stops the background services of the user (the precomputation of its masks and the encryption workers)"""
+        if isinstance(self.key, UserKey) and self.key.masks is not None:
+            self.key.masks.stop()
+            self.key.masks = None
+        if self.encpool is not None:
+            self.encpool.close()
+            self.encpool = None
+
+    def _input(self, start=0, stop=None):
+        # the (quantized) elements [start, stop) of the user input
+        X = self.X[start:stop]
+        if Client.FP and isinstance(X, np.ndarray) and X.dtype.kind == "f":
+            X = Client.FP.quantize(X)
+        return X
+
+    def _share_seed(self, b):
         # generate t-out-of-U shares of b
         shares = Client.SS.share(self.threshold, self.nclients, b)
 
         # encrypt the shares for each user
-        E = {}
-
+        messages = {}
         for share in shares:
             vuser = share.idx
             if self.user == vuser:
                 self.bshares[self.user] = share
                 continue
-            key = AESKEY(self.ckeys[vuser])
-            message = self.user.to_bytes(2,"big") + vuser.to_bytes(2,"big") + gmpy2.to_binary(share.value._value)
-            e = key.encrypt(message)
-            E[vuser] = e
+            messages[vuser] = gmpy2.to_binary(share.value._value)
+        return self.channels.encrypt_many(messages)
 
-        # send user id, encrypted shares, and the encrypted input
-        return self.user, E, Y
-
-    def online_construct(self, eshares):
+    def online_construct(self, eshares, progress=None):
         """Online phase - Construct: User send the shares of the users to the server.
 
         It receives the shares of other users and deduce the alive users. For all not alive user, it computes the protected zero-value using **TJL.ShareProtect**. It returns the shares of the blinding mask seed of alive users and a share of the protected zero-value.
@@ -272,6 +354,9 @@ class Client(object):
         *eshares* : `dict` -- 
             The encrypted shares of the blinding mask of each alive user
 
+        *progress* : `callable` -- 
+            A function called as progress(user, done, total) while the protected zero-value is computed, e.g. to report to the server that the user is still alive (default: `None`)
+
         **Returns**: 
         ----------------
         The user identifier, the shares of the blinding mask seed of alive users, and a share of the protected zero-value (type: (`int`, `dict`, `list`)).
@@ -280,14 +365,10 @@ class Client(object):
 
         self.Ualive = [self.user]
         # deduce the alive users and decrypt the shares
-        for vuser in eshares: 
+        messages = self.channels.decrypt_many(eshares)
+        for vuser in messages: 
             self.Ualive.append(vuser)
-            key = AESKEY(self.ckeys[vuser])
-            message = key.decrypt(eshares[vuser])
-            u = int.from_bytes(message[:2],"big")
-            v = int.from_bytes(message[2:4],"big")
-            share = gmpy2.from_binary(message[4:])
-            assert v == self.user and u == vuser, "invalid encrypted message"
+            share = gmpy2.from_binary(messages[vuser])
             self.bshares[vuser] = Share(self.user, Client.SS.Field(share))
 
 
@@ -300,7 +381,11 @@ class Client(object):
                     continue
                 dropshares.append(self.keyshares[vuser])
             if dropshares:
-                Yzeroshare = Client.TJL.ShareProtect(Client.pp, dropshares, self.step)
+                def report(done, total):
+                    self.recovery = (done, total)
+                    if progress is not None:
+                        progress(self.user, done, total)
+                Yzeroshare = Client.TJL.ShareProtect(Client.pp, dropshares, self.step, report)
 
         # send the secret shares and the missing component
         return self.user, self.bshares, Yzeroshare
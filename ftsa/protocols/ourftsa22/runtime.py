@@ -0,0 +1,401 @@
+"""
+### **Asyncio runtime for the FTSA scheme**
+
+This module runs the `Server` and the `Client`s of the scheme over TCP or Unix sockets with `asyncio`. The messages are the frames of `WireCodec`.
+
+The server reads the frames of every connection in its own task and puts them in a bounded ingest queue: when the queue is full the connection tasks stop reading, so the clients are slowed down by the TCP flow control instead of filling the server memory. A single task decodes the frames and submits them to the `PhaseCollector` of the current phase (see `Server.open_phase`). A phase of an FL round ends when all the expected users answered, or at its deadline once *threshold* users answered (the stragglers are dropped and the recovery of their inputs is triggered). The timeout bounds the wait for the threshold. The setup phases have no deadline: every user must register and share its key, otherwise the setup fails at the timeout. The users recovering the protected zero-value report their progress, so the stragglers of the construct phase can be told from failed users. The encrypted shares are not decoded by the server: their frames are routed to the mailboxes of the recipients (see `Router`). The protected inputs are aggregated as soon as they are accepted (see `Server.submit_ciphertext`), so the server keeps a single protected vector per round. A streaming client (see `Client.online_encrypt_stream`) sends its encrypted shares in a PROTECTED frame without protected input, then its protected chunks in CHUNK frames: it has answered once its chunks cover its whole protected input, and its coverage is its progress. The computations of the server and of the clients are run in an executor, so the event loop keeps serving the connections.
+"""
+
+import asyncio
+import time
+from collections import Counter, defaultdict
+from math import factorial, log2
+
+from ftsa.protocols.ourftsa22.client import Client
+from ftsa.protocols.ourftsa22.server import Server
+from ftsa.protocols.buildingblocks.JoyeLibert import CiphertextVector
+from ftsa.protocols.utils.WireCodec import HEADERSIZE, KEYS, ALLKEYS, SHARES, PROTECTED, CHUNK, CONSTRUCT, START, PROGRESS, body_length, share_entries
+
+
+class ServerRuntime(object):
+    """
+    The network runtime of the server
+
+    ## **Args**:
+    -------------
+    *server* : `Server` --
+        The server state machine
+
+    *deadline* : `float` --
+        The duration of a phase in seconds, after which it is closed if at least *threshold* users answered (default: `None`, wait for all the users)
+
+    *timeout* : `float` --
+        The maximum duration of a phase in seconds (default: 60)
+
+    *queuesize* : `int` --
+        The number of frames the ingest queue holds before applying backpressure (default: 256)
+
+    *maxframe* : `int` --
+        The size in bytes of the largest frame accepted from a client, a connection announcing a larger frame is closed (default: `None`, the size of the largest frame of the scenario, see `max_frame`)
+
+    ## **Attributes**:
+    -------------
+    *server* : `Server` --
+        The server state machine
+
+    *deadline* : `float` --
+        The duration of a phase in seconds
+
+    *timeout* : `float` --
+        The maximum duration of a phase in seconds
+
+    *stragglers* : `list` --
+        The stragglers of each closed phase, with the type of the awaited message and their last reported progress (kind, {u : (done, total) or `None`})
+
+    *latencies* : `list` --
+        The duration of each FL round in seconds
+
+    *ingested* : `int` --
+        The number of bytes received from the clients
+
+    *frames* : `int` --
+        The number of frames received from the clients
+    """
+    def __init__(self, server, deadline=None, timeout=60, queuesize=256, maxframe=None) -> None:
+        super().__init__()
+        self.server = server
+        self.deadline = deadline
+        self.timeout = timeout
+        self.queuesize = queuesize
+        self.maxframe = maxframe or ServerRuntime.max_frame()
+        self.latencies = []
+        self.ingested = 0
+        self.frames = 0
+        self.stragglers = []
+        self._writers = {}
+        self._listener = None
+        self._queue = None
+        self._ingest = None
+        self._kind = None
+        self._ready = None
+        self._setup = False
+        self._streams = {} # the encrypted shares of the streaming users whose protected input is incomplete {u : frame}
+        self._asked = defaultdict(Counter) # number of messages of each type asked to each user {u : {kind : count}}
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """Starts listening on a TCP port (0 for a free port) or on the Unix socket *path*. It returns the listening address"""
+        self._queue = asyncio.Queue(self.queuesize)
+        if path is not None:
+            self._listener = await asyncio.start_unix_server(self._handle, path=path)
+            return path
+        self._listener = await asyncio.start_server(self._handle, host, port)
+        return self._listener.sockets[0].getsockname()[:2]
+
+    async def run(self, nclients, rounds=1):
+        """Runs the setup phase with *nclients* users, then *rounds* FL rounds. It returns the result of each round"""
+        loop = asyncio.get_event_loop()
+        WC = Server.WC
+
+        # Setup-Register: the first frame of each connection (the frames wait in the queue until the ingest starts)
+        self._expect(KEYS, range(1, nclients + 1), setup=True)
+        if self._ingest is None:
+            self._ingest = asyncio.ensure_future(self._consume())
+        allpks, allpkc = await self._gather()
+        allpks, allpkc = await loop.run_in_executor(None, self.server.setup_register, allpks, allpkc)
+
+        # Setup-KeySetup
+        self._expect(SHARES, allpks, setup=True)
+        await self._broadcast(allpks, WC.encode_allkeys(allpks, allpkc))
+        allekshares = await self._gather()
+        ekshares = await loop.run_in_executor(None, self.server.setup_keysetup, allekshares)
+        await self._send({u : ekshares.pull(u) for u in ekshares})
+        users = list(allekshares)
+
+        results = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            self.server.new_fl_step()
+
+            # Online-Encrypt
+            self._expect(PROTECTED, users)
+            await self._broadcast(users, WC.encode_start(self.server.step))
+            # the protected inputs are aggregated by the ingest task
+            allebshares = await self._gather()
+            ebshares = await loop.run_in_executor(None, self.server.online_encrypt, allebshares, {})
+
+            # Online-Construct
+            alive = list(self.server.Ualive)
+            self._expect(CONSTRUCT, alive)
+            await self._send({u : ebshares.pull(u) for u in alive})
+            allbshares, Yzeroshares = await self._gather()
+            results.append(await loop.run_in_executor(None, self.server.online_construct, allbshares, list(Yzeroshares.values())))
+            self.latencies.append(time.perf_counter() - start)
+        return results
+
+    @staticmethod
+    def max_frame():
+        """Returns an upper bound on the size in bytes of the frames sent by the clients in the scenario of the `Server`: the encrypted shares of a TJL key (SHARES) or a protected input with the encrypted shares of its mask seed (PROTECTED)"""
+        n, t = Server.nclients, Server.threshold
+        entry = 8 + 12 + 16 + 2 # entry header, AES-GCM nonce and tag, and the header of a `gmpy2` binary number
+        # a share of the TJL key is the sharing polynomial evaluated at an index up to n
+        ISS = Server.TJL.ISS
+        keyshare = ISS.bitlength + 2 * log2(factorial(n)) + ISS.sigma + (t - 1) * log2(n) + log2(t) + 1
+        shares = 6 + (n - 1) * (entry + int(keyshare) // 8 + 1)
+        protected = 6 + (n - 1) * (entry + (Server.SS.Field(0).p.bit_length() + 7) // 8) + 4 + Server.VE.numbatches * CiphertextVector.width(Server.pp)
+        return HEADERSIZE + max(shares, protected)
+
+    def throughput(self):
+        """Returns the ingest throughput in bytes per second over the measured rounds"""
+        return self.ingested / sum(self.latencies) if self.latencies else 0.0
+
+    async def close(self):
+        """Closes the connections and stops listening"""
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        if self._listener is not None:
+            self._listener.close()
+            await self._listener.wait_closed()
+        if self._ingest is not None:
+            self._ingest.cancel()
+
+    async def _handle(self, reader, writer):
+        user = None
+        received = Counter()
+        try:
+            while True:
+                frame = await _read_frame(reader, self.maxframe)
+                if frame is None:
+                    break
+                # all the client frames start with the user identifier
+                user = int.from_bytes(frame[HEADERSIZE:HEADERSIZE+2], "big")
+                self._writers.setdefault(user, writer)
+                # the n-th message of a type answers the n-th request for it
+                received[frame[3]] += 1
+                await self._queue.put((user, frame, received[frame[3]]))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if user is not None and self._writers.get(user) is writer:
+                del self._writers[user]
+            writer.close()
+
+    async def _consume(self):
+        WC = Server.WC
+        # the encrypted shares are not decoded: the frames are routed to the mailboxes of their recipients
+        decoders = {KEYS : WC.decode_keys, SHARES : _check_shares, PROTECTED : lambda frame: WC.decode_protected(frame, routed=True), CONSTRUCT : WC.decode_construct}
+        while True:
+            user, frame, seq = await self._queue.get()
+            self.ingested += len(frame)
+            self.frames += 1
+            if frame[3] == PROGRESS and self._kind is not None:
+                try:
+                    self.server.phase.report(*WC.decode_progress(frame))
+                except ValueError:
+                    pass
+                continue
+            # the chunks follow the PROTECTED frame of their user (on the same connection)
+            if frame[3] == CHUNK and self._kind == PROTECTED:
+                try:
+                    accepted = self._submit_chunk(*WC.decode_chunk(frame))
+                except (ValueError, AssertionError):
+                    continue
+                if accepted and self.server.phase.ready():
+                    self._ready.set()
+                continue
+            # frames of another phase and late answers to a previous phase are dropped (the collector drops the unexpected users)
+            if frame[3] != self._kind or seq != self._asked[user][self._kind]:
+                continue
+            try:
+                message = decoders[self._kind](frame)
+            except ValueError:
+                continue
+            phase = self.server.phase
+            submit = self._submit_protected if self._kind == PROTECTED else phase.submit
+            if submit(*message) and phase.ready():
+                self._ready.set()
+
+    def _submit_protected(self, user, eshares, Y):
+        # only the encrypted shares are kept by the collector, the protected input is aggregated once the user is accepted
+        phase = self.server.phase
+        if user in self._streams:
+            return False
+        if len(Y) == 0:
+            # a streaming user: it answers with its last chunk
+            if not phase.closed and user in phase.users and user not in phase.messages:
+                self._streams[user] = eshares
+            return False
+        if len(Y) != Server.VE.numbatches or not phase.submit(user, eshares):
+            return False
+        self.server.submit_ciphertext(user, Y)
+        return True
+
+    def _submit_chunk(self, user, offset, Y):
+        phase = self.server.phase
+        if user not in self._streams or phase.closed:
+            return False
+        self.server.submit_ciphertext(user, Y, offset)
+        covered = self.server.Ycovered[user]
+        if covered != [(0, Server.VE.numbatches)]:
+            phase.report(user, sum(end - start for start, end in covered), Server.VE.numbatches)
+            return False
+        return phase.submit(user, self._streams.pop(user))
+
+    def _expect(self, kind, users, setup=False):
+        # must be called before the messages triggering the answers are sent
+        users = list(users)
+        for user in users:
+            self._asked[user][kind] += 1
+        # the clients share their mask seeds with all the users: no user can be dropped during the setup
+        self.server.open_phase(users, None if setup else self.deadline)
+        self._setup = setup
+        self._streams = {}
+        self._kind = kind
+        self._ready = asyncio.Event()
+
+    async def _gather(self):
+        phase = self.server.phase
+        loop = asyncio.get_event_loop()
+        end = loop.time() + self.timeout
+        try:
+            # wait for all the users until the deadline, then for the threshold until the timeout
+            remaining = phase.remaining()
+            if remaining is not None:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), min(remaining, self.timeout))
+                except asyncio.TimeoutError:
+                    pass
+            if not phase.ready():
+                await asyncio.wait_for(self._ready.wait(), max(0.0, end - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        assert not self._setup or phase.complete(), "the setup failed, users {} did not answer before the timeout".format(sorted(phase.users - set(phase.messages)))
+        fields = phase.close()
+        if phase.stragglers:
+            self.stragglers.append((self._kind, phase.straggler_report()))
+        self._kind = None
+        return fields
+
+    async def _send(self, frames):
+        await asyncio.gather(*[self._write(user, frame) for user, frame in frames.items()])
+
+    async def _broadcast(self, users, frame):
+        await self._send({user : frame for user in users})
+
+    async def _write(self, user, frame):
+        writer = self._writers.get(user)
+        if writer is None:
+            return
+        try:
+            writer.write(frame)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+class ClientRuntime(object):
+    """
+    The network driver of a client. It answers the frames of the server with the corresponding `Client` phase until the server closes the connection
+
+    ## **Args**:
+    -------------
+    *client* : `Client` --
+        The client state machine
+
+    *inputs* : `callable` --
+        A function called as inputs(step) that returns the input vector of an FL step (default: `None`, random inputs)
+
+    *slots* : `int` --
+        The number of ciphertexts of the protected chunks sent in the streaming mode (default: `None`, the protected input is sent in one frame, see `Client.online_encrypt_stream`)
+
+    ## **Attributes**:
+    -------------
+    *client* : `Client` --
+        The client state machine
+
+    *steps* : `list` --
+        The FL steps the client took part in
+    """
+    def __init__(self, client, inputs=None, slots=None) -> None:
+        super().__init__()
+        self.client = client
+        self.inputs = inputs
+        self.slots = slots
+        self.steps = []
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, host="127.0.0.1", port=None, path=None):
+        """Connects to the server on a TCP port or on the Unix socket *path*"""
+        if path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(host, port)
+
+    async def run(self):
+        """Registers the client and runs its phases until the server closes the connection"""
+        loop = asyncio.get_event_loop()
+        client = self.client
+        WC = Client.WC
+        registered = False
+        try:
+            await self._write(WC.encode_keys(*client.setup_register()))
+            while True:
+                frame = await _read_frame(self._reader)
+                if frame is None:
+                    break
+                kind = frame[3]
+                if kind == ALLKEYS:
+                    allpks, allpkc = WC.decode_allkeys(frame)
+                    await self._write(WC.encode_shares(*await loop.run_in_executor(None, client.setup_keysetup, allpks, allpkc)))
+                elif kind == SHARES and not registered:
+                    await loop.run_in_executor(None, client.setup_keysetup2, WC.decode_shares(frame)[1])
+                    registered = True
+                elif kind == START:
+                    step = WC.decode_start(frame)
+                    X = self.inputs(step) if self.inputs else None
+                    client.new_fl_step(X)
+                    self.steps.append(step)
+                    if self.slots is None:
+                        await self._write(WC.encode_protected(*await loop.run_in_executor(None, client.online_encrypt)))
+                    else:
+                        # the encrypted shares first, then each chunk as soon as it is protected
+                        user, eshares, chunks = await loop.run_in_executor(None, client.online_encrypt_stream, self.slots)
+                        await self._write(WC.encode_protected(user, eshares, []))
+                        while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                            await self._write(WC.encode_chunk(user, *chunk))
+                elif kind == SHARES:
+                    eshares = WC.decode_shares(frame)[1]
+                    # the progress of the recovery is sent from the executor thread
+                    def progress(user, done, total):
+                        loop.call_soon_threadsafe(self._writer.write, WC.encode_progress(user, done, total))
+                    await self._write(WC.encode_construct(*await loop.run_in_executor(None, client.online_construct, eshares, progress)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writer.close()
+            client.close()
+
+    async def _write(self, frame):
+        self._writer.write(frame)
+        await self._writer.drain()
+
+
+def _check_shares(frame):
+    # checks the encoding of the encrypted shares without decoding them
+    for _ in share_entries(frame):
+        pass
+    return int.from_bytes(frame[HEADERSIZE:HEADERSIZE+2], "big"), frame
+
+async def _read_frame(reader, maxframe=None):
+    try:
+        header = await reader.readexactly(HEADERSIZE)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    length = body_length(header)
+    # the length is checked before the body is read (and allocated)
+    if maxframe is not None and HEADERSIZE + length > maxframe:
+        raise ValueError("frame of {} bytes exceeds the limit of {} bytes".format(HEADERSIZE + length, maxframe))
+    return header + await reader.readexactly(length)
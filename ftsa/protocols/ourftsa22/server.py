@@ -1,12 +1,18 @@
+from bisect import bisect
 from collections import defaultdict
+from types import GeneratorType
 from math import ceil, factorial
 from gmpy2 import mpz
 
-from ftsa.protocols.buildingblocks.utils import subs_vectors, powmod
+from ftsa.protocols.buildingblocks.utils import isubs_vectors
 from ftsa.protocols.buildingblocks.PRG import PRG
 from ftsa.protocols.buildingblocks.ShamirSS import SSS
 from ftsa.protocols.buildingblocks.VectorEncoding import VES
-from ftsa.protocols.buildingblocks.JoyeLibert import TJLS, ServerKey, EncryptedNumber
+from ftsa.protocols.buildingblocks.FixedPointEncoding import FPES
+from ftsa.protocols.buildingblocks.JoyeLibert import TJLS, ServerKey, CiphertextVector
+from ftsa.protocols.utils.WireCodec import WireCodec
+from ftsa.protocols.utils.PhaseCollector import PhaseCollector
+from ftsa.protocols.utils.Router import Router
 
 
 
@@ -25,8 +31,14 @@ class Server(object):
     *ckeys* : `dict` --
         A channel encryption key for each communication channel with each other user {v : key}
 
-    *Y* : `list` --
-        The list of all user's protected inputs
+    *Yagg* : `CiphertextVector` --
+        The running product of the users' protected inputs
+
+    *Ycontrib* : `list` --
+        The users whose protected input is in the running product
+
+    *phase* : `PhaseCollector` --
+        The collector of the messages of the current phase (see `open_phase`)
 
     *delta*  : `int` --
         A constant value equals the factorial of nb. of clients
@@ -54,6 +66,10 @@ class Server(object):
     """the pseudo-random generator"""
     SS = SSS(PRG.security)
     """the secret sharing scheme"""
+    FP = None
+    """the fixed-point encoding scheme of real-valued inputs (default: None, the inputs are integers)"""
+    WC = WireCodec(pp, SS.Field)
+    """the wire codec of the messages"""
 
     def __init__(self) -> None:
         super().__init__()
@@ -61,23 +77,28 @@ class Server(object):
         self.key = ServerKey(Server.pp, mpz(0)) # the server encryption key for JL (we use zero)
         self.U = [] # set of registered user identifiers
         self.Ualive = [] # set of alive users' identifiers 
-        self.Y = [] # aggregation result of the users' ciphertext
+        self.Yagg = None # aggregation result of the users' ciphertext
+        self.Ycontrib = [] # users whose ciphertext is aggregated
+        self.Ycovered = {} # ranges of the protected input of each streaming user already aggregated {u : sorted [(start, end)]}
+        self.phase = None # the collector of the messages of the current phase
         self.delta = 1
 
     @staticmethod
-    def set_scenario(dimension, valuesize, keysize, threshold, nclients, pp):
+    def set_scenario(dimension, valuesize, keysize, threshold, nclients, pp, asarray=False, clip=None):
         """Sets up the parameters of the protocol"""
         Server.dimension = dimension
         Server.valuesize = valuesize
         Server.nclients = nclients
         Server.keysize = keysize
         Server.threshold = threshold
-        Server.VE = VES(keysize // 2, nclients, valuesize, dimension)
+        Server.VE = VES(keysize // 2, nclients, valuesize, dimension, asarray)
         Server.TJL = TJLS(nclients, threshold, Server.VE)
         Server.TJL.Setup(keysize)
         Server.pp = pp
-        Server.prg = PRG(dimension, valuesize)
+        Server.prg = PRG(dimension, valuesize, asarray)
         Server.SS = SSS(PRG.security)
+        Server.FP = FPES(valuesize, clip) if clip else None
+        Server.WC = WireCodec(pp, Server.SS.Field)
 
     def new_fl_step(self):
         """Starts a new FL round. 
@@ -85,9 +106,30 @@ class Server(object):
         It increments the round counter and reinitialize the state."""
         self.step += 1
         self.Ualive = []
-        self.Y = []
+        self.Yagg = None
+        self.Ycontrib = []
+        self.Ycovered = {}
         self.delta = 1
 
+    def open_phase(self, users=None, deadline=None):
+        """Opens the collection of the messages of a phase. The messages are submitted to the returned `PhaseCollector` as they arrive; the phase is closed when all the users answered or, at the deadline, when at least *threshold* users answered, and the users who did not answer are dropped.
+
+        ** Args **:
+        -----------
+        *users* : `list`
+            The users expected to answer (default: the alive users of the round, or the registered users, or all the users)
+
+        *deadline* : `float`
+            The duration of the phase in seconds (default: `None`, wait for all the users)
+
+        **Returns**: 
+        ----------------
+        The collector of the phase (type: `PhaseCollector`)
+        """
+        users = users or self.Ualive or self.U or range(1, Server.nclients + 1)
+        self.phase = PhaseCollector(users, Server.threshold, deadline)
+        return self.phase
+
     def setup_register(self, alldhpkc, alldhpks):
         """Setup phase - Register: Sever forwards users registrations. 
         
@@ -115,20 +157,19 @@ class Server(object):
         ** Args **:
         -----------
         *allekshares* : `dict`
-            The list of encrypted share generated by each user
+            The encrypted shares generated by each user (a dictionary or its encoded SHARES frame)
 
         **Returns**: 
         ----------------
-        A list of encrypted shares destined to each user (type: `dict`)
+        The mailboxes of the encrypted shares destined to each user (type: `Router`, each user pulls its SHARES frame with `Router.pull`)
         """
         assert len(allekshares) >= Server.threshold
 
-        # prepare eshares for each corresponding user
-        ekshares = defaultdict(dict)
+        # route the eshares to the mailbox of each corresponding user
+        ekshares = Router()
         for user in allekshares:
             self.U.append(user)
-            for vuser in allekshares[user]:
-                ekshares[vuser][user] = allekshares[user][vuser]
+            ekshares.post(user, allekshares[user])
         
         self.delta = factorial(len(self.U))
 
@@ -141,34 +182,72 @@ class Server(object):
         ** Args **:
         -----------
         *allebshares* : `dict`
-            The list of encrypted share generated by each user
+            The encrypted shares generated by each user (a dictionary or its encoded SHARES or PROTECTED frame)
 
         *allY* : `dict`
-            The protected number of each user
+            The protected number of each user (or a generator of its protected chunks, see `Client.online_encrypt_stream`), empty if the protected inputs were already aggregated as they arrived (see `submit_ciphertext`)
 
 
         **Returns**: 
         ----------------
-        A list of encrypted shares destined to each user (type: `dict`)
+        The mailboxes of the encrypted shares destined to each user (type: `Router`, each user pulls its SHARES frame with `Router.pull`)
         """
         assert len(allebshares) >= Server.threshold
 
-        # prepare eshares for each corresponding user
-        ebshares = defaultdict(dict)
+        # route the eshares to the mailbox of each corresponding user
+        ebshares = Router()
         for user in allebshares:
             self.Ualive.append(user)
-            for vuser in allebshares[user]:
-                ebshares[vuser][user] = allebshares[user][vuser]
+            ebshares.post(user, allebshares[user])
 
-        # # aggregate all encrypted messages
-        # self.Ytelda = Server.JL.aggregate_vector(list(allY.values()))
-        # if len(allY) < len(self.U):
-        #     self.Ytelda = [ EncryptedNumber( Server.pp, powmod(x.ciphertext, self.delta, Server.pp.nsquare)) for x in self.Ytelda]
-        self.Y = list(allY.values())
+        # aggregate all encrypted messages
+        for user in allY:
+            if isinstance(allY[user], GeneratorType):
+                for offset, Y in allY[user]:
+                    self.submit_ciphertext(user, Y, offset)
+            else:
+                self.submit_ciphertext(user, allY[user])
 
         # send the encrypted b shares for each corresponding user
         return ebshares 
 
+    def submit_ciphertext(self, user, Y, offset=None):
+        """Online phase - Encrypt: Sever aggregates the protected input of a user as soon as it arrives. 
+
+        It multiplies the protected input into a running product and records the user as a contributor, so that the server only keeps one protected vector whatever the number of users. In the streaming mode, each chunk is multiplied into the elements of the running product starting at its offset.
+        
+        ** Args **:
+        -----------
+        *user* : `int`
+            The user identifier
+
+        *Y* : `CiphertextVector`
+            The protected input of the user (or a chunk of it)
+
+        *offset* : `int`
+            The index of the first element of the chunk (default: `None`, Y is the whole protected input)
+        """
+        if not isinstance(Y, CiphertextVector):
+            Y = CiphertextVector.fromlist(Server.pp, Y)
+        if offset is None:
+            assert user not in self.Ycontrib, "duplicate protected input"
+            if self.Yagg is None:
+                self.Yagg = Y.copy()
+            else:
+                self.Yagg += Y
+            self.Ycontrib.append(user)
+            return
+        if self.Yagg is None:
+            self.Yagg = CiphertextVector.identity(Server.pp, Server.VE.numbatches)
+        end = offset + len(Y)
+        assert 0 <= offset and end <= Server.VE.numbatches, "protected chunk out of range"
+        if user not in self.Ycovered:
+            assert user not in self.Ycontrib, "duplicate protected input"
+            self.Ycovered[user] = []
+            self.Ycontrib.append(user)
+        _cover(self.Ycovered[user], offset, end)
+        self.Yagg.add_at(Y, offset)
+
     def online_construct(self, allbshares, Yzeroshares = None):
         """Online phase - Construct: Sever construct the blinding masks and the protected zero-value and aggregates the users' inputs. 
         
@@ -182,9 +261,11 @@ class Server(object):
 
         **Returns**: 
         ----------------
-        The sum of the alive users' inputs (type: `list`)
+        The sum of the alive users' inputs (type: `list`, or a `numpy.float64` array if the inputs are real-valued)
         """
         assert len(allbshares) >= Server.threshold
+        # a streamed protected input cannot be removed from the aggregate, hence it must be complete
+        assert all(covered == [(0, Server.VE.numbatches)] for covered in self.Ycovered.values()), "incomplete protected input"
 
         # reconstruct the blinding mask seed b for each user 
         bshares = defaultdict(list)
@@ -192,16 +273,9 @@ class Server(object):
             for vuser in allbshares[user]:
                 bshares[vuser].append(allbshares[user][vuser])
 
-        lagcoef = []
-        b = {}
-        B = defaultdict(list)
-        for vuser in bshares:
-            assert len(bshares[vuser]) >= Server.threshold
-            if not lagcoef:
-                lagcoef = Server.SS.lagrange(bshares[vuser])
-            b[vuser] = Server.SS.recon(bshares[vuser],lagcoef)
-            # recompute the blinding vector B
-            B[vuser] = Server.prg.eval(b[vuser])
+        assert all(len(bshares[vuser]) >= Server.threshold for vuser in bshares)
+        # the seeds held by the same users are reconstructed in one batch
+        b = Server.SS.recon_users(bshares)
         Yzeroshares = [y for y in Yzeroshares if y]
         if Yzeroshares:
             assert len(Yzeroshares) >= Server.threshold
@@ -211,11 +285,26 @@ class Server(object):
             Yzero = None
         
         # aggregate
-        XplusB = Server.TJL.Agg(Server.pp, self.key, self.step, self.Y, Yzero)
+        XplusB = Server.TJL.Finalize(Server.pp, self.key, self.step, self.Yagg, len(self.Ycontrib), Yzero)
 
         
-        # unmask
-        for user in B:
-            XplusB = subs_vectors(XplusB, B[user], 2**(Server.VE.elementsize))
-        
+        # unmask with the sum of all the blinding vectors B
+        if b:
+            B = Server.prg.eval_sum(list(b.values()), [1] * len(b), 2**(Server.VE.elementsize))
+            XplusB = isubs_vectors(XplusB, B, 2**(Server.VE.elementsize))
+
+        if Server.FP:
+            return Server.FP.dequantize(XplusB, len(self.Ycontrib))
         return XplusB
+
+
+def _cover(ranges, start, end):
+    # adds [start, end) to the sorted disjoint ranges, merging the adjacent ones (chunks sent in order keep a single range)
+    i = bisect(ranges, (start, end))
+    assert (i == 0 or ranges[i-1][1] <= start) and (i == len(ranges) or end <= ranges[i][0]), "overlapping protected chunk"
+    if i < len(ranges) and ranges[i][0] == end:
+        end = ranges.pop(i)[1]
+    if i > 0 and ranges[i-1][1] == start:
+        start = ranges.pop(i-1)[0]
+        i -= 1
+    ranges.insert(i, (start, end))
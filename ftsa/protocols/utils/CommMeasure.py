@@ -1,4 +1,5 @@
 from ecdsa.keys import VerifyingKey
+import numpy as np
 import csv, os
 
 STRSIZE = 8
@@ -35,12 +36,20 @@ class Bandwidth(object):
     def measure_sent_data(self, data=None, hint=None):
         if not data:
             return
-        self.logvalue("sent", getrealsize(data, hint))
+        self.logvalue("sent", _size(data, hint))
 
     def measure_rcvd_data(self, data=None, hint=None):
         if not data:
             return
-        self.logvalue("rcvd", getrealsize(data, hint)) 
+        self.logvalue("rcvd", _size(data, hint)) 
+
+    def sent_counter(self):
+        """Returns a `ByteCounter` logging the size of a message sent in several frames"""
+        return ByteCounter(self, "sent")
+
+    def rcvd_counter(self):
+        """Returns a `ByteCounter` logging the size of a message received in several frames"""
+        return ByteCounter(self, "rcvd")
 
     def finish(self):
         if not self.logfile.closed:
@@ -48,13 +57,50 @@ class Bandwidth(object):
 
 
 
+class ByteCounter(object):
+    """Counts the bytes of the frames of one message (e.g. a streamed input) and logs their total as a single measurement when it is closed. It can be used as a context manager"""
+    def __init__(self, bandwidth, direction) -> None:
+        super().__init__()
+        self.bandwidth = bandwidth
+        self.direction = direction
+        self.nbytes = 0
+
+    def add(self, frame):
+        """Counts a frame (or a number of bytes) and returns it"""
+        self.nbytes += frame if isinstance(frame, int) else len(frame)
+        return frame
+
+    def close(self):
+        """Logs the total size of the counted frames"""
+        if self.nbytes:
+            self.bandwidth.logvalue(self.direction, self.nbytes*BYTSIZE)
+        self.nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class User(object):
     size = 16 
     def __init__(self, user) -> None:
         super().__init__()
         self.user = user
 
+def _size(data, hint=None):
+    # encoded frames are counted without walking the message
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)*BYTSIZE
+    return getrealsize(data, hint)
+
 def getrealsize(obj, hint=None):
+    if isinstance(obj, np.ndarray):
+        h = hint
+        if isinstance(hint, list):
+            h = hint[1]
+        return obj.size * getrealsize(1, h)
     if not obj:
         return 0
     if isinstance(obj, int):
@@ -66,7 +112,7 @@ def getrealsize(obj, hint=None):
             return hint[0]
     elif isinstance(obj, str):
         return len(obj)*STRSIZE
-    elif isinstance(obj, bytes):
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
         return len(obj)*BYTSIZE
     elif isinstance(obj, User):
         return User.size
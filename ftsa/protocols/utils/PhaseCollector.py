@@ -0,0 +1,109 @@
+"""
+### **Phase Collector**
+
+This module collects the messages sent by the users during a phase of a protocol. A phase is closed as soon as all the expected users answered, or at its deadline if at least *threshold* users answered by then: the users who did not answer are the stragglers and are treated as dropped by the protocol.
+"""
+
+import time
+
+
+class PhaseCollector(object):
+    """
+    The collector of the messages of a phase
+
+    ## **Args**:
+    -------------
+    *users* : `list` --
+        The users expected to answer
+
+    *threshold* : `int` --
+        The minimum number of users needed to close the phase at its deadline
+
+    *deadline* : `float` --
+        The duration of the phase in seconds, after which it can be closed with *threshold* users (default: `None`, wait for all the users)
+
+    *clock* : `callable` --
+        The clock measuring the deadline (default: `time.monotonic`)
+
+    ## **Attributes**:
+    -------------
+    *users* : `set` --
+        The users expected to answer
+
+    *threshold* : `int` --
+        The minimum number of users needed to close the phase at its deadline
+
+    *messages* : `dict` --
+        The message of each user who answered {u : message}
+
+    *progress* : `dict` --
+        The last progress reported by each user still computing its answer {u : (done, total)}
+
+    *stragglers* : `list` --
+        The users who did not answer before the phase was closed
+
+    *late* : `int` --
+        The number of messages received after the phase was closed
+
+    *closed* : `bool` --
+        Whether the phase is closed
+    """
+    def __init__(self, users, threshold, deadline=None, clock=time.monotonic) -> None:
+        super().__init__()
+        self.users = set(users)
+        self.threshold = threshold
+        self.clock = clock
+        self.start = clock()
+        self.deadline = None if deadline is None else self.start + deadline
+        self.messages = {}
+        self.progress = {}
+        self.stragglers = []
+        self.late = 0
+        self.closed = False
+
+    def submit(self, user, *message):
+        """Records the message of a user (the arguments following the user identifier). It returns `False` if the message is rejected: the phase is closed, the user is not expected or it already answered"""
+        if self.closed:
+            self.late += 1
+            return False
+        if user not in self.users or user in self.messages:
+            return False
+        self.messages[user] = message
+        self.progress.pop(user, None)
+        return True
+
+    def report(self, user, done, total):
+        """Records the progress of a user still computing its answer (e.g. with the callback of `Client.online_construct`)"""
+        if not self.closed and user in self.users and user not in self.messages:
+            self.progress[user] = (done, total)
+
+    def complete(self):
+        """Returns `True` if all the expected users answered"""
+        return len(self.messages) == len(self.users)
+
+    def expired(self):
+        """Returns `True` if the deadline is passed"""
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def remaining(self):
+        """Returns the time left before the deadline in seconds (`None` without deadline)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock())
+
+    def ready(self):
+        """Returns `True` if the phase can be closed: all the users answered, or the deadline is passed and at least *threshold* users answered"""
+        return self.complete() or (self.expired() and len(self.messages) >= self.threshold)
+
+    def close(self):
+        """Closes the phase and records the stragglers. It returns, for each field of the messages, a dictionary {u : field} (e.g. two dictionaries for messages made of the encrypted shares and the protected input)"""
+        assert len(self.messages) >= self.threshold, "not enough users answered the phase ({} < {})".format(len(self.messages), self.threshold)
+        self.closed = True
+        self.stragglers = sorted(self.users - set(self.messages))
+        nfields = len(next(iter(self.messages.values()))) if self.messages else 0
+        fields = tuple({user : message[i] for user, message in self.messages.items()} for i in range(nfields))
+        return fields[0] if nfields == 1 else fields
+
+    def straggler_report(self):
+        """Returns the stragglers with their last reported progress {u : (done, total) or `None`}"""
+        return {user : self.progress.get(user) for user in (self.stragglers if self.closed else sorted(self.users - set(self.messages)))}
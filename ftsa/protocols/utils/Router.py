@@ -0,0 +1,65 @@
+"""
+### **Router**
+
+This module forwards the encrypted shares that the users send to each other through the server. Each recipient has an append-only mailbox: a buffer that holds the encoded shares destined to it, laid out as the body of a SHARES frame of `WireCodec`. Routing a user's shares appends each encoded share to the mailbox of its recipient. The shares are never decoded and no object is kept per share, so the memory and the time of the fan-out are linear in the number of bytes routed.
+
+A mailbox is released when its recipient pulls it. The frame it returns is the mailbox buffer itself (only its header is filled in), so nothing is copied when the frame is handed over.
+"""
+
+from ftsa.protocols.utils.WireCodec import HEADERSIZE, SHARES, header, share_entries
+
+_PREFIX = HEADERSIZE + 6 # header, recipient and number of shares
+
+
+class Router(object):
+    """
+    The router of the encrypted shares of a phase. A recipient gets its shares with `pull`, which returns the SHARES frame to be decoded with `WireCodec.decode_shares`
+
+    ## **Attributes**:
+    -------------
+    *mailboxes* : `dict` --
+        The mailbox of each recipient that has not pulled it yet {v : `bytearray`}
+
+    *counts* : `dict` --
+        The number of shares in each mailbox {v : count}
+
+    *routed* : `int` --
+        The number of bytes of the encoded shares routed
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.mailboxes = {}
+        self.counts = {}
+        self.routed = 0
+
+    def post(self, sender, shares):
+        """Appends the encrypted shares sent by a user to the mailboxes of their recipients. *shares* is a dictionary {v : `EncryptedMessage`} or an encoded SHARES or PROTECTED frame of the user (only its encrypted shares are routed)"""
+        prefix = int(sender).to_bytes(2, "big")
+        mailboxes, counts = self.mailboxes, self.counts
+        for vuser, entry in share_entries(shares):
+            box = mailboxes.get(vuser)
+            if box is None:
+                box = mailboxes[vuser] = bytearray(_PREFIX)
+                counts[vuser] = 0
+            box += prefix
+            box += entry
+            counts[vuser] += 1
+            self.routed += len(entry) + 2
+
+    def pull(self, user):
+        """Releases the mailbox of a user. It returns the SHARES frame of the encrypted shares destined to the user (the mailbox buffer, not a copy)"""
+        box = self.mailboxes.pop(user, None)
+        if box is None:
+            box = bytearray(_PREFIX)
+        count = self.counts.pop(user, 0)
+        box[:_PREFIX] = header(SHARES, len(box) - HEADERSIZE) + int(user).to_bytes(2, "big") + count.to_bytes(4, "big")
+        return box
+
+    def __contains__(self, user):
+        return user in self.mailboxes
+
+    def __iter__(self):
+        return iter(list(self.mailboxes))
+
+    def __len__(self):
+        return len(self.mailboxes)
@@ -0,0 +1,483 @@
+"""
+### **Wire Codec**
+
+This module encodes the messages of the protocols to compact binary frames and decodes them back.
+
+A frame is a header followed by a body:
+
+    magic (2 bytes) | version (1 byte) | message type (1 byte) | body length (4 bytes)
+
+All the integers are big-endian. User identifiers take 2 bytes, the residues modulo \\(N^2\\) and the field elements are written with the fixed width of their modulus, the masked vectors of ccsftsa17 are bit-packed and all the variable-length fields (keys, AES-GCM ciphertexts) are length-prefixed. The decoder works on `memoryview` slices of the frame, so the byte fields of the decoded messages (e.g. `EncryptedMessage` ciphertexts) are not copied.
+"""
+
+import struct
+from math import ceil
+
+import numpy as np
+from gmpy2 import mpz
+
+from ftsa.protocols.buildingblocks.AESGCM128 import EncryptedMessage
+from ftsa.protocols.buildingblocks.IntegerSS import IShare
+from ftsa.protocols.buildingblocks.JoyeLibert import CiphertextVector, EncryptedNumber
+from ftsa.protocols.buildingblocks.KeyAggreement import KAS
+from ftsa.protocols.buildingblocks.ShamirSS import Share
+from ftsa.protocols.buildingblocks.utils import to_array
+
+MAGIC = b"FT"
+"""The first bytes of a frame"""
+VERSION = 1
+"""The version of the encoding"""
+
+_HEADER = struct.Struct(">2sBBI")
+HEADERSIZE = _HEADER.size
+"""The number of bytes of a frame header"""
+_EMHEADER = struct.Struct(">HBBI") # user, nonce length, tag length, ciphertext length
+_EMLENGTHS = struct.Struct(">BBI") # the lengths of an encrypted message, after its user
+
+KEYS = 1
+"""A user's public keys: (user, pks, pkc)"""
+ALLKEYS = 2
+"""The public keys of all the users: ({u : pks}, {u : pkc})"""
+SHARES = 3
+"""Encrypted shares: (user, {v : `EncryptedMessage`})"""
+PROTECTED = 4
+"""The ourftsa22 protected input: (user, {v : `EncryptedMessage`}, `CiphertextVector`)"""
+CHUNK = 5
+"""A chunk of an ourftsa22 protected input: (user, offset, `CiphertextVector`)"""
+CONSTRUCT = 6
+"""The ourftsa22 construct message: (user, {v : `Share`}, list of `IShare` or `None`)"""
+MASKED = 7
+"""The ccsftsa17 masked input: (user, masked vector)"""
+USERS = 8
+"""A list of users"""
+UNMASK = 9
+"""The ccsftsa17 unmasking message: (user, {v : key `Share`}, {v : b `Share`})"""
+START = 10
+"""The start of an FL step: step"""
+PROGRESS = 11
+"""The progress of a user computing its answer: (user, done, total)"""
+
+
+class WireCodec(object):
+    """
+    The codec of the messages of a scenario
+
+    ## **Args**:
+    -------------
+    *pp* : `PublicParam` --
+        The public parameters of TJL (for the ourftsa22 ciphertexts, default: `None`)
+
+    *field* : `Field` --
+        The field of the shares of the blinding mask seeds (default: `None`)
+
+    *keyfield* : `Field` --
+        The field of the shares of the DH secret keys (for ccsftsa17, default: `None`)
+
+    *valuesize* : `int` --
+        The bit length of an element of the ccsftsa17 masked vectors (default: `None`)
+
+    *asarray* : `bool` --
+        If `True`, the decoded masked vectors are `numpy.uint64` arrays (default: `False`)
+
+    ## **Attributes**:
+    -------------
+    *pp* : `PublicParam` --
+        The public parameters of TJL
+
+    *field* : `Field` --
+        The field of the shares of the blinding mask seeds
+
+    *keyfield* : `Field` --
+        The field of the shares of the DH secret keys
+
+    *valuesize* : `int` --
+        The bit length of an element of the masked vectors
+
+    *asarray* : `bool` --
+        Whether the decoded masked vectors are `numpy.uint64` arrays
+    """
+    def __init__(self, pp=None, field=None, keyfield=None, valuesize=None, asarray=False) -> None:
+        super().__init__()
+        self.pp = pp
+        self.field = field
+        self.keyfield = keyfield
+        self.valuesize = valuesize
+        self.asarray = asarray
+
+    @staticmethod
+    def kind(frame):
+        """Returns the message type of a frame (after checking its header)"""
+        return _open(frame)[0]
+
+    def encode_keys(self, user, pks, pkc):
+        """Encodes the public keys of a user"""
+        w = _Writer()
+        w.user(user)
+        w.pk(pks)
+        w.pk(pkc)
+        return w.frame(KEYS)
+
+    def decode_keys(self, frame):
+        """Decodes the public keys of a user. It returns (user, pks, pkc)"""
+        r = _Reader(frame, KEYS)
+        return r.done((r.user(), r.pk(), r.pk()))
+
+    def encode_allkeys(self, allpks, allpkc):
+        """Encodes the public keys of all the users"""
+        assert allpks.keys() == allpkc.keys()
+        w = _Writer()
+        w.u32(len(allpks))
+        for user in allpks:
+            w.user(user)
+            w.pk(allpks[user])
+            w.pk(allpkc[user])
+        return w.frame(ALLKEYS)
+
+    def decode_allkeys(self, frame):
+        """Decodes the public keys of all the users. It returns ({u : pks}, {u : pkc})"""
+        r = _Reader(frame, ALLKEYS)
+        allpks, allpkc = {}, {}
+        for _ in range(r.u32()):
+            user = r.user()
+            allpks[user] = r.pk()
+            allpkc[user] = r.pk()
+        return r.done((allpks, allpkc))
+
+    def encode_shares(self, user, eshares):
+        """Encodes a dictionary of encrypted shares {v : `EncryptedMessage`} sent by (or to) a user"""
+        w = _Writer()
+        w.user(user)
+        w.emessages(eshares)
+        return w.frame(SHARES)
+
+    def decode_shares(self, frame):
+        """Decodes a dictionary of encrypted shares. It returns (user, {v : `EncryptedMessage`})"""
+        r = _Reader(frame, SHARES)
+        return r.done((r.user(), r.emessages()))
+
+    def encode_protected(self, user, eshares, Y):
+        """Encodes the ourftsa22 protected input of a user with its encrypted shares"""
+        w = _Writer()
+        w.user(user)
+        w.emessages(eshares)
+        w.residues(_residues(Y), self._width())
+        return w.frame(PROTECTED)
+
+    def decode_protected(self, frame, routed=False):
+        """Decodes the ourftsa22 protected input of a user. It returns (user, {v : `EncryptedMessage`}, `CiphertextVector`). If *routed* is `True`, the encrypted shares are not decoded: they are returned as a SHARES frame (a copy of their encoding, which does not keep the frame alive), to be posted to a `Router`"""
+        r = _Reader(frame, PROTECTED)
+        user = r.user()
+        if routed:
+            r.skip_emessages()
+            eshares = header(SHARES, r.pos - _HEADER.size) + r.data[_HEADER.size:r.pos]
+        else:
+            eshares = r.emessages()
+        return r.done((user, eshares, CiphertextVector(self.pp, r.residues(self._width()))))
+
+    def encode_chunk(self, user, offset, Y):
+        """Encodes a chunk (starting at *offset*) of the ourftsa22 protected input of a user"""
+        w = _Writer()
+        w.user(user)
+        w.u32(offset)
+        w.residues(_residues(Y), self._width())
+        return w.frame(CHUNK)
+
+    def decode_chunk(self, frame):
+        """Decodes a chunk of the ourftsa22 protected input of a user. It returns (user, offset, `CiphertextVector`)"""
+        r = _Reader(frame, CHUNK)
+        return r.done((r.user(), r.u32(), CiphertextVector(self.pp, r.residues(self._width()))))
+
+    def encode_construct(self, user, bshares, Yzeroshare=None):
+        """Encodes the ourftsa22 construct message of a user: the shares of the blinding mask seeds and the (optional) shares of the protected zero-value"""
+        w = _Writer()
+        w.user(user)
+        w.shares(bshares, self._fwidth(self.field))
+        if Yzeroshare is None:
+            w.u8(0)
+        else:
+            w.u8(1)
+            w.user(Yzeroshare[0].idx if Yzeroshare else user)
+            w.residues([s.value.ciphertext for s in Yzeroshare], self._width())
+        return w.frame(CONSTRUCT)
+
+    def decode_construct(self, frame):
+        """Decodes the ourftsa22 construct message of a user. It returns (user, {v : `Share`}, list of `IShare` or `None`)"""
+        r = _Reader(frame, CONSTRUCT)
+        user = r.user()
+        bshares = r.shares(user, self.field)
+        Yzeroshare = None
+        if r.u8():
+            idx = r.user()
+            Yzeroshare = [IShare(idx, EncryptedNumber(self.pp, c)) for c in r.residues(self._width())]
+        return r.done((user, bshares, Yzeroshare))
+
+    def encode_masked(self, user, Y):
+        """Encodes the ccsftsa17 masked input of a user, bit-packed on *valuesize* bits per element"""
+        w = _Writer()
+        w.user(user)
+        w.u32(len(Y))
+        w.raw(pack_uints(Y, self.valuesize))
+        return w.frame(MASKED)
+
+    def decode_masked(self, frame):
+        """Decodes the ccsftsa17 masked input of a user. It returns (user, masked vector)"""
+        r = _Reader(frame, MASKED)
+        user = r.user()
+        count = r.u32()
+        Y = unpack_uints(r.take(ceil(count * self.valuesize / 8)), self.valuesize, count)
+        return r.done((user, Y if self.asarray else _tolist(Y)))
+
+    def encode_users(self, users):
+        """Encodes a list of users"""
+        w = _Writer()
+        w.u32(len(users))
+        w.raw(np.asarray(list(users), dtype=">u2").tobytes())
+        return w.frame(USERS)
+
+    def decode_users(self, frame):
+        """Decodes a list of users"""
+        r = _Reader(frame, USERS)
+        count = r.u32()
+        return r.done(np.frombuffer(r.take(2 * count), dtype=">u2").tolist())
+
+    def encode_unmask(self, user, kshares, bshares):
+        """Encodes the ccsftsa17 unmasking message of a user: the shares of the DH secret keys of the dropped users and of the blinding masks of the alive users"""
+        w = _Writer()
+        w.user(user)
+        w.shares(kshares, self._fwidth(self.keyfield))
+        w.shares(bshares, self._fwidth(self.field))
+        return w.frame(UNMASK)
+
+    def decode_unmask(self, frame):
+        """Decodes the ccsftsa17 unmasking message of a user. It returns (user, {v : key `Share`}, {v : b `Share`})"""
+        r = _Reader(frame, UNMASK)
+        user = r.user()
+        return r.done((user, r.shares(user, self.keyfield), r.shares(user, self.field)))
+
+    def encode_start(self, step):
+        """Encodes the start of an FL step"""
+        w = _Writer()
+        w.u32(step)
+        return w.frame(START)
+
+    def decode_start(self, frame):
+        """Decodes the start of an FL step. It returns the step"""
+        r = _Reader(frame, START)
+        return r.done(r.u32())
+
+    def encode_progress(self, user, done, total):
+        """Encodes the progress of a user computing its answer (e.g. the protected zero-value of `Client.online_construct`)"""
+        w = _Writer()
+        w.user(user)
+        w.u32(done)
+        w.u32(total)
+        return w.frame(PROGRESS)
+
+    def decode_progress(self, frame):
+        """Decodes the progress of a user. It returns (user, done, total)"""
+        r = _Reader(frame, PROGRESS)
+        return r.done((r.user(), r.u32(), r.u32()))
+
+    def _width(self):
+        assert self.pp is not None, "the codec has no public parameters"
+        return CiphertextVector.width(self.pp)
+
+    @staticmethod
+    def _fwidth(field):
+        assert field is not None, "the codec has no field"
+        return (field(0).p.bit_length() + 7) // 8
+
+
+def pack_uints(V, bits):
+    """Packs a vector of non-negative integers of *bits* bits (at most 64) to bytes, the elements being laid out in little-endian bit order"""
+    assert bits <= 64, "elements must fit in 64 bits"
+    V = to_array(V)
+    elements = V.astype("<u8").view(np.uint8).reshape(-1, 8)
+    if bits % 8 == 0:
+        return elements[:, :bits // 8].tobytes()
+    b = np.unpackbits(elements[:, :ceil(bits / 8)], axis=1, bitorder="little")[:, :bits]
+    return np.packbits(b.reshape(-1), bitorder="little").tobytes()
+
+def unpack_uints(data, bits, count):
+    """Unpacks *count* integers of *bits* bits from bytes packed with `pack_uints`. It returns a `numpy.uint64` array"""
+    assert bits <= 64, "elements must fit in 64 bits"
+    raw = np.frombuffer(data, dtype=np.uint8)
+    elements = np.zeros((count, 8), dtype=np.uint8)
+    if bits % 8 == 0:
+        elements[:, :bits // 8] = raw[:count * bits // 8].reshape(count, bits // 8)
+    else:
+        b = np.unpackbits(raw, bitorder="little")[:count * bits].reshape(count, bits)
+        eb = ceil(bits / 8)
+        padded = np.zeros((count, eb * 8), dtype=np.uint8)
+        padded[:, :bits] = b
+        elements[:, :eb] = np.packbits(padded, axis=1, bitorder="little")
+    return elements.view("<u8").reshape(-1).astype(np.uint64)
+
+
+def header(kind, length):
+    """Returns the header of a frame of type *kind* whose body has *length* bytes"""
+    return _HEADER.pack(MAGIC, VERSION, kind, length)
+
+def body_length(header):
+    """Checks the header of a frame (its first `HEADERSIZE` bytes) and returns the length of the body that follows, e.g. to read frames from a stream"""
+    magic, version, _, length = _HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError("not a protocol frame")
+    if version != VERSION:
+        raise ValueError("unsupported frame version {}".format(version))
+    return length
+
+def share_entries(shares):
+    """Iterates the encrypted shares of a dictionary {v : `EncryptedMessage`} or of an encoded SHARES or PROTECTED frame, without decoding them. It yields (v, entry) where entry is the encoding of the share that follows its peer identifier in a frame (a `memoryview` of the frame if *shares* is a frame)"""
+    if isinstance(shares, dict):
+        for vuser, e in shares.items():
+            yield vuser, _EMLENGTHS.pack(len(e.nonce), len(e.tag), len(e.ct)) + e.nonce + e.tag + e.ct
+        return
+    kind, _ = _open(shares)
+    if kind not in (SHARES, PROTECTED):
+        raise ValueError("a frame of type {} has no encrypted shares".format(kind))
+    data = memoryview(shares)
+    pos, end = _HEADER.size + 6, len(data)
+    if pos > end:
+        raise ValueError("truncated frame")
+    for _ in range(int.from_bytes(data[pos-4:pos], "big")):
+        if pos + _EMHEADER.size > end:
+            raise ValueError("truncated frame")
+        vuser, nl, tl, cl = _EMHEADER.unpack_from(data, pos)
+        size = _EMHEADER.size + nl + tl + cl
+        if pos + size > end:
+            raise ValueError("truncated frame")
+        yield vuser, data[pos+2:pos+size]
+        pos += size
+
+def _residues(Y):
+    if isinstance(Y, CiphertextVector):
+        return Y.ciphertexts
+    return [y.ciphertext for y in Y]
+
+def _tolist(V):
+    return [int(v) for v in V]
+
+def _open(frame):
+    if len(frame) < _HEADER.size:
+        raise ValueError("truncated frame")
+    kind = frame[3]
+    length = body_length(frame)
+    if length != len(frame) - _HEADER.size:
+        raise ValueError("the frame length does not match its header")
+    return kind, length
+
+
+class _Writer(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.parts = []
+
+    def frame(self, kind):
+        body = b''.join(self.parts)
+        return header(kind, len(body)) + body
+
+    def raw(self, data):
+        self.parts.append(bytes(data))
+
+    def u8(self, x):
+        self.parts.append(x.to_bytes(1, "big"))
+
+    def u32(self, x):
+        self.parts.append(x.to_bytes(4, "big"))
+
+    def user(self, x):
+        self.parts.append(int(x).to_bytes(2, "big"))
+
+    def pk(self, pk):
+        data = KAS.backend.pk_bytes(pk)
+        self.u8(len(data))
+        self.raw(data)
+
+    def emessages(self, emessages):
+        self.u32(len(emessages))
+        parts = self.parts
+        for vuser, e in emessages.items():
+            parts.append(_EMHEADER.pack(vuser, len(e.nonce), len(e.tag), len(e.ct)))
+            parts.append(e.nonce)
+            parts.append(e.tag)
+            parts.append(e.ct)
+
+    def residues(self, residues, w):
+        self.u32(len(residues))
+        self.parts.append(b''.join(int(c).to_bytes(w, "big") for c in residues))
+
+    def shares(self, shares, w):
+        self.u32(len(shares))
+        for vuser, share in shares.items():
+            self.user(vuser)
+            self.parts.append(int(share.value._value).to_bytes(w, "big"))
+
+
+class _Reader(object):
+    def __init__(self, frame, kind) -> None:
+        super().__init__()
+        k, _ = _open(frame)
+        if k != kind:
+            raise ValueError("expected a frame of type {} but got {}".format(kind, k))
+        self.data = memoryview(frame)
+        self.pos = _HEADER.size
+
+    def done(self, result):
+        if self.pos != len(self.data):
+            raise ValueError("trailing bytes in frame")
+        return result
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise ValueError("truncated frame")
+        view = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return view
+
+    def u8(self):
+        return self.take(1)[0]
+
+    def u32(self):
+        return int.from_bytes(self.take(4), "big")
+
+    def user(self):
+        return int.from_bytes(self.take(2), "big")
+
+    def pk(self):
+        return KAS.backend.load_pk(bytes(self.take(self.u8())))
+
+    def emessages(self):
+        emessages = {}
+        count = self.u32()
+        data, pos, end = self.data, self.pos, len(self.data)
+        for _ in range(count):
+            if pos + _EMHEADER.size > end:
+                raise ValueError("truncated frame")
+            vuser, nl, tl, cl = _EMHEADER.unpack_from(data, pos)
+            pos += _EMHEADER.size
+            if pos + nl + tl + cl > end:
+                raise ValueError("truncated frame")
+            emessages[vuser] = EncryptedMessage(data[pos+nl+tl:pos+nl+tl+cl], data[pos+nl:pos+nl+tl], data[pos:pos+nl])
+            pos += nl + tl + cl
+        self.pos = pos
+        return emessages
+
+    def skip_emessages(self):
+        for _ in range(self.u32()):
+            self.take(_EMHEADER.size)
+            _, nl, tl, cl = _EMHEADER.unpack_from(self.data, self.pos - _EMHEADER.size)
+            self.take(nl + tl + cl)
+
+    def residues(self, w):
+        count = self.u32()
+        data = self.take(count * w)
+        return [mpz(int.from_bytes(data[i:i+w], "big")) for i in range(0, count * w, w)]
+
+    def shares(self, user, field):
+        w = WireCodec._fwidth(field)
+        shares = {}
+        for _ in range(self.u32()):
+            vuser = self.user()
+            shares[vuser] = Share(user, field(int.from_bytes(self.take(w), "big")))
+        return shares